@@ -1,223 +1,83 @@
-import re
+import os
 import calendar
-import pandas as pd
-from io import BytesIO
 import streamlit as st
-import dataprocess as dp  # 根据实际处理需求编写的数据处理模块
+from cube import pivot  # 汇总立方体透视
+from jobs import JobRunner, DONE, FAILED  # 后台任务（进程池中读取文件、处理数据、生成报表）
+from result_store import ResultStore, DEFAULT_DIRECTORY, DEFAULT_TTL, DEFAULT_MAX_BYTES  # 报表的磁盘存储
+import movement  # 出入库流水的动销索引
+import history  # 各月明细的历史数据
+import upload_cache  # 上传文件解析结果的缓存
+from profiling import StageProfiler, PIPELINE_STAGES  # 各步骤耗时记录
+from exporters import EXPORTERS, DEFAULT_FORMAT, get_exporter  # 导出格式
 from datetime import date
-from openpyxl.styles import Font, Alignment, PatternFill, NamedStyle
-from openpyxl.formatting.rule import DataBarRule, FormulaRule
 
 
-# 将 Pandas DataFrame 对象转换为 Excel 文件格式的字节流
-@st.cache_resource
-def to_excel(df_s11, df_s12, df_s2, df_s3, df_s4, df_s5, df2,
-            sheet_name1='正常品种销售-口腔', sheet_name2='正常品种销售-洗护', sheet_name3='电商',
-            sheet_name4='促销品&非卖', sheet_name5='拓展部', sheet_name6='齿说', sheet_names='异常类别定义'):
-    output = BytesIO()
-    writer = pd.ExcelWriter(output, engine='openpyxl')
-    df_all = pd.concat([df_s11, df_s12, df_s2, df_s3, df_s4, df_s5])
-    # 将多个 DataFrame 存入字典
-    df_dict = {
-        '汇总':df_all, # 新增明细汇总 
-        '口腔数据': df_s11,
-        '洗护数据': df_s12,
-        '电商数据': df_s2,
-        '促销品&非卖数据': df_s3,
-        '拓展部数据': df_s4,
-        '齿说数据': df_s5
-    }
-    # 创建一个新的工作表，用于集中写入所有 DataFrame
-    combined_sheet_name = '汇总数据'
-    worksheet_combined = writer.book.create_sheet(combined_sheet_name)
-    # 初始化当前写入行
-    current_row = 1
-    # 循环处理字典中的每个 DataFrame
-    for df_name, df in df_dict.items():
-        # 按分类分组并进行聚合操作
-        result = df.groupby('分类',observed=False).agg({
-            '产品编码': 'nunique', # 'count'
-            '库存总件数': 'sum'
-        }).reset_index()
-        # 重命名列名
-        result.columns = ['分类', 'SKU个数', '件数']
-        # 写入来源描述
-        worksheet_combined.cell(row=current_row, column=1, value=f'数据来源: {df_name}')
-        current_row += 1
-        # 写入列名
-        for col_index, col_name in enumerate(result.columns, start=1):
-            worksheet_combined.cell(row=current_row, column=col_index, value=col_name)
-        current_row += 1
-        # 写入数据
-        for row in result.values.tolist():
-            for col_index, value in enumerate(row, start=1):
-                worksheet_combined.cell(row=current_row, column=col_index, value=value)
-            current_row += 1
-        # 空一行分隔不同 DataFrame 的结果
-        current_row += 1
+# 页面设置
+st.set_page_config(page_title="数据处理工具", page_icon=":material/home:", layout='centered')
 
-    df2.to_excel(writer, index=False, header=False, sheet_name=sheet_names)
-    df_s11.to_excel(writer, index=False, sheet_name=sheet_name1)
-    df_s12.to_excel(writer, index=False, sheet_name=sheet_name2)
-    df_s2.to_excel(writer, index=False, sheet_name=sheet_name3)
-    df_s3.to_excel(writer, index=False, sheet_name=sheet_name4)
-    df_s4.to_excel(writer, index=False, sheet_name=sheet_name5)
-    df_s5.to_excel(writer, index=False, sheet_name=sheet_name6)
-    # 获取工作簿和工作表
-    workbook = writer.book
-    worksheet1 = writer.sheets[sheet_names]
-    worksheet2 = writer.sheets[sheet_name1]
-    worksheet3 = writer.sheets[sheet_name2]
-    worksheet4 = writer.sheets[sheet_name3]
-    worksheet5 = writer.sheets[sheet_name4]
-    worksheet6 = writer.sheets[sheet_name5]
-    worksheet7 = writer.sheets[sheet_name6]
-    worksheet_combined = writer.sheets[combined_sheet_name]
 
-    # 确保百分比样式只被创建一次
-    if "percentage_style" not in workbook.named_styles:
-        percentage_style = NamedStyle(name="percentage_style", number_format='0.00%')
-        workbook.add_named_style(percentage_style)
+@st.cache_resource
+def get_job_runner():
+    # 所有会话共用一个进程池和结果存储，可在 secrets 中配置进程数、存储目录、有效期（小时）和容量（MB）
+    store = ResultStore(
+        directory=st.secrets.get("result_dir", DEFAULT_DIRECTORY),
+        ttl=st.secrets.get("result_ttl_hours", DEFAULT_TTL / 3600) * 3600,
+        max_bytes=st.secrets.get("result_max_mb", DEFAULT_MAX_BYTES / 2 ** 20) * 2 ** 20)
+    movement_dir = st.secrets.get("movement_dir", movement.DEFAULT_DIRECTORY)
+    history_dir = st.secrets.get("history_dir", history.DEFAULT_DIRECTORY)
+    # 上传文件解析结果的磁盘缓存，各子进程共用
+    cache_dir = st.secrets.get("upload_cache_dir", upload_cache.DEFAULT_DIRECTORY)
+    cache_max_bytes = st.secrets.get("upload_cache_mb", upload_cache.DEFAULT_DISK_MAX_BYTES / 2 ** 20) * 2 ** 20
+    options = dict(store=store, movement_dir=movement_dir, history_dir=history_dir, cache_dir=cache_dir,
+                   cache_max_bytes=cache_max_bytes)
+    # 每个任务解析多个上传文件的进程数（默认在任务进程中依次解析）
+    read_workers = st.secrets.get("read_workers")
+    if read_workers:
+        options['read_workers'] = read_workers
+    # 库存文件很大时按批处理（每批行数），内存占用与库存总行数无关
+    batch_size = st.secrets.get("batch_size")
+    if batch_size:
+        options['batch_size'] = batch_size
+    workers = st.secrets.get("job_workers")
+    if workers:
+        return JobRunner(max_workers=workers, **options)
+    return JobRunner(**options)
+
+
+def collect_job(job):
+    # 任务完成后把结果放入会话状态，报表只保存磁盘上的路径
+    result = job.result
+    profiler = StageProfiler()
+    profiler.records = result['records']
+    st.session_state.excel_path = result['excel_path']
+    st.session_state.cube = result['cube']
+    st.session_state.delta = result.get('delta', False)
+    st.session_state.export_format = result.get('export_format', DEFAULT_FORMAT)
+    st.session_state.profiler = profiler
+    # 配置了日志路径时写入 JSON lines
+    profile_log = st.secrets.get("profile_log")
+    if profile_log:
+        profiler.write_jsonl(profile_log, date_value=job.date_value)
+
+
+@st.fragment(run_every=1)
+def show_job_progress():
+    # 处理中每秒刷新一次进度，完成后重新运行整个页面以显示下载按钮
+    job = get_job_runner().get(st.session_state.job_id)
+    if job is None:
+        del st.session_state.job_id
+        st.rerun()
+    elif job.status == DONE:
+        collect_job(job)
+        del st.session_state.job_id
+        st.rerun()
+    elif job.status == FAILED:
+        del st.session_state.job_id
+        st.session_state.job_error = job.error
+        st.rerun()
     else:
-        percentage_style = workbook.named_styles["percentage_style"]
-
-    # 调用格式设置函数
-    set_description_sheet_format(worksheet1, df2)
-    set_material_sheet_format(worksheet2, df_s11, percentage_style)
-    set_material_sheet_format(worksheet3, df_s12, percentage_style)
-    set_material_sheet_format(worksheet4, df_s2, percentage_style)
-    set_material_sheet_format(worksheet5, df_s3, percentage_style)
-    set_material_sheet_format(worksheet6, df_s4, percentage_style)
-    set_material_sheet_format(worksheet7, df_s5, percentage_style)
-    add_data_bar_rule(worksheet2, start_row=2, end_row=len(df1) + 1, column='E')
-    add_data_bar_rule(worksheet3, start_row=2, end_row=len(df1) + 1, column='E')
-    add_data_bar_rule(worksheet4, start_row=2, end_row=len(df1) + 1, column='E')
-    add_data_bar_rule(worksheet5, start_row=2, end_row=len(df1) + 1, column='E')
-    add_data_bar_rule(worksheet6, start_row=2, end_row=len(df1) + 1, column='E')
-    add_data_bar_rule(worksheet7, start_row=2, end_row=len(df1) + 1, column='E')
-    writer.close()
-    processed_data = output.getvalue()
-    return processed_data
-
-
-
-def add_data_bar_rule(worksheet, start_row, end_row, column, color="c00000"):
-    # 范围字符串
-    range_str = f'{column}{start_row}:{column}{end_row}'
-
-    # 添加条件格式规则，清除库存为负数的数据
-    negative_rule = FormulaRule(formula=[f'AND({column}{start_row}<0)'], stopIfTrue=True)
-    worksheet.conditional_formatting.add(range_str, negative_rule)
-
-    # 添加数据条规则
-    data_bar_rule = DataBarRule(
-        start_type='num', start_value=0,
-        end_type='max',
-        color=color
-    )
-    worksheet.conditional_formatting.add(range_str, data_bar_rule)
-
-# 示例用法
-# add_data_bar_rule(worksheet, start_row=2, end_row=len(df1) + 1, column='E')
-
-def set_material_sheet_format(worksheet, df1, percentage_style):
-    # 设置列宽
-    for idx, column in enumerate(worksheet.columns, start=1):
-        column_letter = column[0].column_letter
-        if idx == 1:
-            worksheet.column_dimensions[column_letter].width = 16
-        elif idx == 5:
-            worksheet.column_dimensions[column_letter].width = 22
-        elif idx == 7:
-            worksheet.column_dimensions[column_letter].width = 30
-        else:
-            worksheet.column_dimensions[column_letter].width = 16
-
-    # 应用百分比格式到指定列
-    column_name = '%(剩余效期/总效期)'
-    column_index = df1.columns.get_loc(column_name) + 1  # +1 是因为 Excel 列索引从 1 开始
-    for row in worksheet.iter_rows(min_row=2, max_row=worksheet.max_row, min_col=column_index, max_col=column_index):
-        for cell in row:
-            cell.style = percentage_style
+        st.progress(job.progress, text=f"{job.status}：{job.stage or '等待空闲进程'}")
 
-    # 定义将 RGB 颜色值转换为十六进制颜色代码的函数
-    def rgb_to_hex(r, g, b):
-        return '{:02x}{:02x}{:02x}'.format(r, g, b)
-
-    # 定义不同列所需的颜色
-    colors = {
-        1: rgb_to_hex(226, 107, 10),
-        2: rgb_to_hex(49, 134, 155),
-        3: rgb_to_hex(226, 107, 10),
-        4: rgb_to_hex(226, 107, 10),
-        5: rgb_to_hex(118, 147, 60),
-        6: rgb_to_hex(118, 147, 60)
-    }
-
-    # 默认颜色
-    default_color = "346c9c"
-
-    # 遍历第一行的每个单元格
-    for col_index, cell in enumerate(worksheet[1], start=1):
-        # 设置字体为加粗，颜色为白色
-        cell.font = Font(bold=True, color="FFFFFF")
-        # 根据列索引获取相应的颜色，如果没有指定则使用默认颜色
-        fill_color = colors.get(col_index, default_color)
-        # 设置填充颜色
-        cell.fill = PatternFill(start_color=fill_color, end_color=fill_color, fill_type="solid")
-        # 设置单元格内容居中对齐
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-    for row in worksheet.iter_rows(min_row=2, max_row=worksheet.max_row, min_col=1, max_col=worksheet.max_column):
-        for cell in row:
-            if cell.column == 7 or cell.column == 14:  # G列是第7列
-                cell.alignment = Alignment(horizontal="left", vertical="center")
-            else:
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-
-
-
-def set_description_sheet_format(worksheet, df2):
-    # 设置列宽
-    worksheet.column_dimensions['A'].width = 22
-    worksheet.column_dimensions['B'].width = 108
-    # 设置行高
-    for row in range(1, 12):  # 1~11行行高设置为36
-        worksheet.row_dimensions[row].height = 36
-    # 设置标题样式
-    for cell in worksheet[1]:
-        cell.font = Font(bold=True, size=16)
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-    # 设置剩余行的标题样式
-    for row in range(2, worksheet.max_row + 1):  # 从第二行开始
-        for cell in worksheet[row]:
-            cell.font = Font(size=14, color="000000")
-            cell.alignment = Alignment(horizontal="left", vertical="center")
-    # 合并A1和B1
-    worksheet.merge_cells('A1:B1')
-
-    # 设置合并单元格的对齐方式
-    worksheet['A1'].alignment = Alignment(horizontal="center", vertical="center")
-
-    # 保证样式设置不会被合并操作覆盖
-    for row in worksheet['A1:B1']:
-        for cell in row:
-            cell.font = Font(bold=True, size=16)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-    # 设置A2:A8单元格的样式
-    for row in worksheet['A2:A8']:
-        for cell in row:
-            cell.font = Font(size=14, color="000000")
-            cell.alignment = Alignment(horizontal="left", vertical="center")
-
-    # 设置C2:C8单元格的样式
-    for row in worksheet['C2:C8']:
-        for cell in row:
-            cell.font = Font(size=14, color="000000", bold=True)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-# 页面设置
-st.set_page_config(page_title="数据处理工具", page_icon=":material/home:", layout='centered')
 
 with st.container(border=True):
     st.header('成品库存异常情况数据处理', divider="rainbow")
@@ -240,39 +100,103 @@ with st.container(border=True):
     date_value = st.date_input(label="请选择日期,(默认为上月的最后一天)", value=default_date)
     # st.write(date_value)
     st.subheader('1.库存数据文件上传', divider='grey')
-    uploaded_file1 = st.file_uploader(label="请选择库存数据Excel文件(.xlsx格式)上传", accept_multiple_files=False, type=["xlsx"])
+    # 各制造中心分别导出的文件可一起上传，合并处理，明细表最后一列为来源文件
+    uploaded_files1 = st.file_uploader(label="请选择库存数据Excel文件(.xlsx格式)上传，可多选", accept_multiple_files=True, type=["xlsx"])
     st.subheader('2.月末呆滞数据文件上传', divider='grey')
-    uploaded_file2 = st.file_uploader(label="请选择呆滞数据Excel文件(.xlsx格式)上传", accept_multiple_files=False, type=["xlsx"])
+    uploaded_files2 = st.file_uploader(label="请选择呆滞数据Excel文件(.xlsx格式)上传，可多选", accept_multiple_files=True, type=["xlsx"])
+    st.subheader('3.出入库流水上传(可选)', divider='grey')
+    # 流水并入已保存的动销索引，按月末日期得到"≥180天无动销"清单，可代替或补充呆滞数据文件
+    uploaded_files3 = st.file_uploader(label="请选择出入库流水Excel文件(.xlsx格式)上传，需包含 产品编码、批次号、所在仓库、业务日期", accept_multiple_files=True, type=["xlsx"])
+    has_movements = movement.index_version(get_job_runner().movement_dir) is not None
+    use_movements = st.checkbox('根据出入库流水判断无动销（包含以前上传的流水）', value=has_movements or bool(uploaded_files3))
+    save_history = st.checkbox('保存本月明细到历史数据（同一月份重新处理时覆盖）', value=True)
+    # 变化报表：与历史数据中上一个月份比较，只导出新增、消失、分类或数量有变化的批次
+    history_store = history.HistoryStore(get_job_runner().history_dir)
+    base_month = history_store.previous_month(history.month_of(date_value))
+    delta = st.checkbox(f"只导出与 {base_month} 相比的变化" if base_month else "只导出与上一月份相比的变化（历史数据中没有更早的月份）",
+                        disabled=base_month is None)
+    # 导出格式：带格式的 Excel；数据量很大时用常量内存的 Excel；供其他系统读取时用 Parquet/CSV 压缩包
+    export_format = st.selectbox('导出格式', list(EXPORTERS), format_func=lambda name: EXPORTERS[name].label,
+                                 disabled=delta)
+    with st.expander('性能分析(可选)'):
+        profile_stage = st.selectbox('对以下步骤开启 cProfile', ['不开启'] + PIPELINE_STAGES)
+        trace_stage = st.selectbox('对以下步骤开启 tracemalloc', ['不开启'] + PIPELINE_STAGES)
+        show_timing = st.checkbox('处理完成后显示各步骤耗时')
     col1, col2 = st.columns(2)
 
     with col1:
         if st.button(label="数据处理", type="primary", key="data_process"):
-            if uploaded_file1 and uploaded_file2:
-                # 读取文件并缓存
-                df1 = pd.read_excel(uploaded_file1, header=0)  # 库存信息
-                df2 = pd.read_excel(uploaded_file2, header=0)  # 呆滞数据文件
-                df_res, df2_res = dp.read_data(df1, df2)
-                df_res = dp.calculate_expiry(df_res, date_value)
-                df_res = dp.expiry_classification(df_res)
-                df_res = dp.merge_and_mark(df_res, df2_res)
-                df_res = dp.classify_items(df_res)
-                df_res = dp.filter_and_calculate(df_res)
-                df_res = dp.sort_and_filter(df_res)
-                df_s11, df_s12, df_s2, df_s3, df_s4, df_s5 = dp.filter_special_cases(df_res)
-                df2 = dp.generate_description_df()
-                
-                excel_file = to_excel(df_s11, df_s12, df_s2, df_s3, df_s4, df_s5, df2)
-                st.session_state.excel_file = excel_file
+            if uploaded_files1 and (uploaded_files2 or use_movements and (uploaded_files3 or has_movements)):
+                # 在后台进程中处理，页面不被阻塞；内容相同的提交合并为同一个任务
+                cp_warehouses = dict(st.secrets["ccp_warehouse"])
+                st.session_state.job_id = get_job_runner().submit(
+                    [(f.name, f.getvalue()) for f in uploaded_files1],  # 库存信息
+                    [(f.name, f.getvalue()) for f in uploaded_files2],  # 呆滞数据文件
+                    date_value, cp_warehouses,
+                    profile_stage=profile_stage if profile_stage != '不开启' else None,
+                    trace_stage=trace_stage if trace_stage != '不开启' else None,
+                    ledger=[(f.name, f.getvalue()) for f in uploaded_files3] if use_movements else None,
+                    use_movements=use_movements, save_history=save_history, delta=delta,
+                    export_format=export_format)
+                st.session_state.pop('job_error', None)
             else:
                 st.info("请先上传数据文件!")
     with col2:
-        if 'excel_file' in st.session_state:
-            st.download_button(
-                label="下载文件",
-                data=st.session_state.excel_file,
-                type="primary",
-                file_name="产成品月末库存异常情况.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+        if 'job_id' in st.session_state:
+            show_job_progress()
+        elif 'excel_path' in st.session_state and os.path.exists(st.session_state.excel_path):
+            # download_button 会把整个文件读入 Streamlit 的内存媒体存储，且每次页面重新运行都会再读一次；
+            # 只在点击"准备下载"后的这一次运行中读取报表，之后的运行不再显示下载按钮，文件随即从内存中释放
+            exporter = get_exporter(st.session_state.get('export_format', DEFAULT_FORMAT))
+            file_name = "产成品月末库存变化" if st.session_state.get('delta') else "产成品月末库存异常情况"
+            if st.button(label="准备下载", key="prepare_download"):
+                with open(st.session_state.excel_path, 'rb') as f:
+                    st.download_button(
+                        label="下载文件",
+                        data=f,
+                        type="primary",
+                        file_name=file_name + exporter.suffix,
+                        mime=exporter.mime
+                    )
+        elif 'excel_path' in st.session_state:
+            st.info("处理结果已过期，请重新进行数据处理。")
         else:
-            st.info("请先上传数据并进行数据处理。")
\ No newline at end of file
+            st.info("请先上传数据并进行数据处理。")
+    if 'job_error' in st.session_state:
+        st.error(f"数据处理失败：{st.session_state.job_error}")
+
+    # 按批处理的变化报表没有汇总立方体
+    if st.session_state.get('cube') is not None:
+        with st.expander('汇总预览'):
+            # 数据集 × 分类 的 SKU个数 / 件数，与报表中的汇总数据一致
+            measure = st.radio('指标', ['SKU个数', '件数', '数量'], horizontal=True)
+            st.dataframe(pivot(st.session_state.cube, measure))
+
+    months = history_store.months()
+    if months:
+        with st.expander('历史查询'):
+            # 只读取包含该 SKU/批次的分区
+            col3, col4 = st.columns(2)
+            code = col3.text_input('产品编码').strip()
+            batch = col4.text_input('批次号').strip()
+            if code or batch:
+                st.dataframe(history_store.series(产品编码=code or None, 批次号=batch or None), hide_index=True)
+            # 两个月份之间的分类变化
+            col5, col6 = st.columns(2)
+            from_month = col5.selectbox('起始月份', months, index=max(len(months) - 2, 0))
+            to_month = col6.selectbox('对比月份', months, index=len(months) - 1)
+            if from_month != to_month:
+                detail, counts = history_store.transitions(from_month, to_month)
+                st.dataframe(counts)
+                st.dataframe(detail, hide_index=True)
+
+    if show_timing and 'profiler' in st.session_state:
+        with st.expander('各步骤耗时', expanded=True):
+            st.dataframe(st.session_state.profiler.to_frame(), hide_index=True)
+            for record in st.session_state.profiler.records:
+                if 'profile' in record:
+                    st.caption(f"cProfile: {record['stage']}")
+                    st.code(record['profile'])
+                if 'allocations' in record:
+                    st.caption(f"tracemalloc: {record['stage']}")
+                    st.code('\n'.join(record['allocations']))
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+命令行批处理入口（不依赖 streamlit）
+
+单个任务：
+    python batch.py --inventory 库存.xlsx --stale 呆滞.xlsx --date 2024-12-31 \
+        --warehouses .streamlit/secrets.toml --output 产成品月末库存异常情况.xlsx
+
+多个任务（公司 × 月份）并行处理：
+    python batch.py --jobs jobs.csv --warehouses .streamlit/secrets.toml --workers 4
+    jobs.csv 列：inventory, stale, date, output，可选列 warehouses 覆盖默认映射文件
+
+多个制造中心的文件合并处理（明细表最后一列为来源文件，任务清单中以分号分隔）：
+    python batch.py --inventory 库存_牙膏.xlsx 库存_日化.xlsx --stale 呆滞_牙膏.xlsx 呆滞_日化.xlsx ...
+
+由出入库流水判断无动销（流水并入 --movements 目录中的动销索引，可代替 --stale）：
+    python batch.py --inventory 库存.xlsx --ledger 流水.xlsx --movements data/movements ...
+
+各月明细写入历史数据（按 月份/仓库分类 分区的 Parquet，可用 history.HistoryStore 查询）：
+    python batch.py ... --history data/history
+
+只输出与历史数据中上一个月份相比的变化（新增、消失、分类或数量变化）：
+    python batch.py ... --history data/history --delta
+    （多个任务时按月份顺序依次处理）
+
+导出为常量内存的 xlsx，或供下游分析的 Parquet / CSV 压缩包（各工作表一个文件）：
+    python batch.py ... --format parquet --output 产成品月末库存异常情况.zip
+
+超出内存的库存文件按批处理（每批 50000 行）：
+    python batch.py ... --batch-size 50000
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import ingest
+from exporters import EXPORTERS, DEFAULT_FORMAT
+from movement import update_index
+from pipeline import read_jobs, run_job
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='成品库存异常情况数据处理（批处理）')
+    parser.add_argument('--inventory', nargs='+', help='库存数据文件(.xlsx)，可多个')
+    parser.add_argument('--stale', nargs='+', help='呆滞数据文件(.xlsx)，可多个')
+    parser.add_argument('--date', help='月末日期，格式 YYYY-MM-DD')
+    parser.add_argument('--output', help='输出文件路径(.xlsx，parquet/csv 格式为 .zip)')
+    parser.add_argument('--jobs', help='任务清单(.csv)，指定后忽略单个任务参数')
+    parser.add_argument('--warehouses', required=True, help='所在仓库 → 仓库分类 映射文件(.toml/.json/.csv/.xlsx)')
+    parser.add_argument('--workers', type=int, default=None, help='并行进程数，默认为 CPU 核数')
+    parser.add_argument('--ledger', nargs='+', help='出入库流水文件(.xlsx)，并入动销索引')
+    parser.add_argument('--movements', help='动销索引目录，指定时由出入库流水判断无动销')
+    parser.add_argument('--history', help='历史数据目录，指定时各任务的明细写入历史数据')
+    parser.add_argument('--delta', action='store_true', help='只输出与历史数据中上一个月份相比的变化，需要 --history')
+    parser.add_argument('--format', choices=list(EXPORTERS), default=DEFAULT_FORMAT,
+                        help='导出格式：xlsx 带格式，xlsx-fast 常量内存，parquet/csv 为 zip 压缩包')
+    parser.add_argument('--batch-size', type=int, default=None, help='按批处理库存数据的每批行数，默认一次读入')
+    args = parser.parse_args(argv)
+    if not args.jobs and not all([args.inventory, args.stale or args.movements, args.date, args.output]):
+        parser.error('需要 --jobs，或同时指定 --inventory --stale(或 --movements) --date --output')
+    if args.ledger and not args.movements:
+        parser.error('--ledger 需要同时指定 --movements')
+    if args.delta and not args.history:
+        parser.error('--delta 需要同时指定 --history')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.jobs:
+        jobs = read_jobs(args.jobs)
+    else:
+        jobs = [{'inventory': args.inventory, 'stale': args.stale, 'date': args.date, 'output': args.output}]
+    if args.ledger:
+        # 流水先并入索引，各任务只读取索引；与页面等其他进程同时更新时由更新锁保证不互相覆盖
+        update_index(ingest.read_many(args.ledger, ingest.read_ledger), args.movements)
+
+    workers = args.workers
+    if args.delta:
+        # 变化报表依赖上一个月份的历史数据，各任务按月份顺序依次处理
+        jobs = sorted(jobs, key=lambda job: job['date'])
+        workers = 1
+
+    # 多个任务并行时，每个任务在自己的进程中依次读取文件，不再各自按 CPU 核数启动进程池
+    read_workers = 1 if (workers or os.cpu_count() or 1) > 1 and len(jobs) > 1 else None
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(run_job, job['inventory'], job['stale'], job['date'],
+                            job.get('warehouses') or args.warehouses, job['output'], args.batch_size,
+                            movement_dir=args.movements, history_dir=args.history, delta=args.delta,
+                            export_format=args.format, read_workers=read_workers): job
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                records = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[失败] {job['output']}: {e}", file=sys.stderr)
+            else:
+                seconds = sum(record['seconds'] for record in records)
+                print(f"[完成] {job['output']} ({seconds:.1f}秒)")
+    print(f"共 {len(jobs)} 个任务，失败 {failed} 个，总耗时 {time.perf_counter() - start:.1f}秒")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
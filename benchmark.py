@@ -0,0 +1,225 @@
+"""
+性能测试：用模拟数据按不同行数运行 dataprocess 各步骤与报表导出，记录耗时和峰值内存
+
+    python benchmark.py                          # 默认 10k / 100k / 1M 行
+    python benchmark.py --sizes 10000 100000     # 指定行数
+    python benchmark.py --workbooks              # 同时测试 xlsx 读取（需先写出模拟文件，较慢）
+    python benchmark.py --legacy                 # 不做类型转换、不开启写时复制（对比用）
+    python benchmark.py --exporters              # 同一份分表结果按各导出格式导出，比较耗时和文件大小
+    python benchmark.py --sizes 2000000 --verify  # 同时运行原实现（legacy.py），比较耗时、峰值内存并检查结果一致
+
+每次结果追加到 benchmark_results.jsonl，并与上一次相同步骤、相同行数的结果比较，
+耗时超过上次的 --threshold 倍时标记为退化。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from functools import partial
+
+import pandas as pd
+
+import dataprocess as dp
+import ingest
+import legacy
+import synthetic
+from cube import build_cube
+from excel_export import to_excel
+from exporters import EXPORTERS
+from profiling import count_rows
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_RESULTS = 'benchmark_results.jsonl'
+AS_OF = '2024-12-31'
+
+
+def measure(func, *args, memory=True):
+    """
+    运行一次计时；memory 为 True 时再在 tracemalloc 下运行一次记录峰值内存
+    :return: (结果, 耗时秒数, 峰值内存字节数或 None)
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def untyped_detail(df1, df2):
+    """
+    不做类型转换、不开启写时复制时 sort_and_filter 的结果，用于检查类型声明不改变明细的数值
+    """
+    with pd.option_context('mode.copy_on_write', False):
+        df_res, df2_res = dp.read_data(df1, df2, synthetic.WAREHOUSE_MAPPING)
+        df_res = dp.calculate_expiry(df_res, AS_OF)
+        df_res = dp.expiry_classification(df_res)
+        df_res = dp.merge_and_mark(df_res, df2_res)
+        df_res = dp.classify_items(df_res)
+        df_res = dp.filter_and_calculate(df_res)
+        return dp.sort_and_filter(df_res)
+
+
+def run_size(n_rows, memory=True, workbooks=False, compact=True, exporters=False, verify=False):
+    """
+    按指定行数生成模拟数据并依次运行各步骤
+    :param compact: 与 pipeline.process 相同，按类型声明转换并在写时复制模式下运行
+    :param exporters: 同时按各导出格式导出（步骤名 export_<格式>），记录输出大小
+    :param verify: 同时运行原实现（步骤名 <步骤>_legacy），记录结果是否一致（matches）；
+                   模拟数据中加入小数和空的库存总件数，并检查类型转换后明细的数值不变
+    """
+    df1 = synthetic.make_inventory(n_rows, fractional=0.02 if verify else 0.0)
+    df2 = synthetic.make_stale(df1)
+    mode = 'compact' if compact else 'legacy'
+    results = []
+
+    def step(stage, func, *args):
+        result, seconds, peak = measure(func, *args, memory=memory)
+        record = {'stage': stage, 'rows': n_rows, 'mode': mode, 'rows_in': count_rows(list(args)),
+                  'seconds': round(seconds, 4), 'peak_bytes': peak}
+        # 导出步骤记录输出文件大小
+        if isinstance(result, bytes):
+            record['output_bytes'] = len(result)
+        results.append(record)
+        peak_text = f'{peak / 2 ** 20:8.1f}MiB' if peak is not None else '       -'
+        size_text = f' {len(result) / 2 ** 20:8.1f}MiB 输出' if isinstance(result, bytes) else ''
+        print(f'{n_rows:>9} {stage:<24}{seconds:9.3f}s {peak_text}{size_text}', flush=True)
+        return result
+
+    def check(stage, same):
+        # 记在原实现的步骤上
+        results[-1]['matches'] = same
+        print(f"{n_rows:>9} {stage:<24}{'一致' if same else '[不一致]'}", flush=True)
+
+    if workbooks:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'inventory.xlsx')
+            synthetic.write_workbook(df1, path)
+            step('read_inventory', ingest.read_inventory, path)
+
+    with pd.option_context('mode.copy_on_write', compact):
+        df_res, df2_res = step('read_data', dp.read_data, df1, df2, synthetic.WAREHOUSE_MAPPING)
+        if compact:
+            df_res = step('apply_schema', dp.apply_schema, df_res)
+            df2_res = dp.apply_schema(df2_res)
+        df_res = step('calculate_expiry', dp.calculate_expiry, df_res, AS_OF, compact)
+        df_res = step('expiry_classification', dp.expiry_classification, df_res)
+        marked = step('merge_and_mark', dp.merge_and_mark, df_res, df2_res)
+        if verify:
+            expected = step('merge_and_mark_legacy', legacy.merge_and_mark, df_res, df2_res)
+            check('merge_and_mark', all(legacy.same_values(marked[col], expected[col]) for col in expected.columns))
+            # 只有表头的呆滞数据（或出入库流水中没有无动销的批次）
+            empty = df2_res.iloc[:0]
+            # 原实现不能处理空的分类列（原流程中呆滞数据为 object 列）
+            expected = step('merge_and_mark_empty_legacy', legacy.merge_and_mark, df_res, empty.astype(object))
+            result = dp.merge_and_mark(df_res, empty)
+            check('merge_and_mark_empty', all(legacy.same_values(result[col], expected[col])
+                                              for col in expected.columns))
+        df_res = marked
+        classified = step('classify_items', dp.classify_items, df_res)
+        if verify:
+            expected = step('classify_items_legacy', legacy.classify_items, df_res)
+            check('classify_items', legacy.same_values(classified['分类'], expected['分类']))
+        df_res = classified
+        df_res = step('filter_and_calculate', dp.filter_and_calculate, df_res)
+        df_res = step('sort_and_filter', dp.sort_and_filter, df_res)
+        frames = step('filter_special_cases', dp.filter_special_cases, df_res)
+    if verify and compact:
+        expected = step('sort_and_filter_untyped', untyped_detail, df1, df2)
+        check('apply_schema', df_res.index.sort_values().equals(expected.index.sort_values()) and all(
+            legacy.same_values(df_res[col], expected.loc[df_res.index, col])
+            for col in ['分类', '品规', '库存总件数', '数量', '剩余效期天数', '%(剩余效期/总效期)']))
+    cube = step('summary_cube', build_cube, frames)
+    step('to_excel', partial(to_excel, cube=cube), *frames, dp.generate_description_df())
+    if exporters:
+        for name, exporter in EXPORTERS.items():
+            step(f'export_{name}', exporter.export, frames, dp.generate_description_df(), cube)
+    return results
+
+
+def load_previous(path):
+    """
+    每个 (步骤, 行数) 最近一次的结果
+    """
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                item = json.loads(line)
+                previous[(item['stage'], item['rows'], item.get('mode', 'legacy'))] = item
+    return previous
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, previous, threshold):
+    """
+    与上次结果比较，返回退化的步骤
+    """
+    regressions = []
+    for item in results:
+        before = previous.get((item['stage'], item['rows'], item['mode']))
+        if before is None or not before['seconds']:
+            continue
+        ratio = item['seconds'] / before['seconds']
+        if ratio > threshold:
+            regressions.append((item, before, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='数据处理性能测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='测试行数')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='结果文件(JSON lines)')
+    parser.add_argument('--no-memory', action='store_true', help='不测量峰值内存（只运行一次）')
+    parser.add_argument('--workbooks', action='store_true', help='同时测试 xlsx 读取')
+    parser.add_argument('--legacy', action='store_true', help='不做类型转换、不开启写时复制')
+    parser.add_argument('--exporters', action='store_true', help='同时比较各导出格式的耗时和文件大小')
+    parser.add_argument('--verify', action='store_true', help='同时运行原实现，比较耗时并检查结果一致')
+    parser.add_argument('--threshold', type=float, default=1.2, help='耗时超过上次的倍数时视为退化')
+    parser.add_argument('--fail-on-regression', action='store_true', help='有退化时返回非零退出码')
+    args = parser.parse_args(argv)
+
+    previous = load_previous(args.results)
+    run = {'run_at': datetime.now().isoformat(timespec='seconds'), 'revision': git_revision()}
+    results = []
+    for n_rows in args.sizes:
+        results.extend(run_size(n_rows, memory=not args.no_memory, workbooks=args.workbooks, compact=not args.legacy,
+                                exporters=args.exporters, verify=args.verify))
+
+    with open(args.results, 'a', encoding='utf-8') as f:
+        for item in results:
+            f.write(json.dumps({**run, **item}, ensure_ascii=False) + '\n')
+
+    regressions = compare(results, previous, args.threshold)
+    for item, before, ratio in regressions:
+        print(f"[退化] {item['stage']} ({item['rows']} 行): {before['seconds']:.3f}s -> {item['seconds']:.3f}s "
+              f"(×{ratio:.2f}，上次 {before.get('revision')} {before.get('run_at')})")
+    if not regressions and previous:
+        print('与上次结果相比无退化')
+    mismatches = [item for item in results if item.get('matches') is False]
+    return 1 if mismatches or (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
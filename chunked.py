@@ -0,0 +1,195 @@
+import os
+import pickle
+import tempfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+import dataprocess as dp
+import ingest
+from cube import DATASETS
+from delta import build_delta, delta_to_excel
+from excel_export import MATERIAL_SHEET_NAMES
+from exporters import DEFAULT_FORMAT, get_exporter
+from history import month_of
+from keyindex import KeyIndex
+from profiling import StageProfiler
+
+# 分批（外存）处理：库存数据按批读取和处理，明细按 (明细表, 分类) 暂存到磁盘，
+# 合计与汇总数据逐批累加，内存占用只与批大小（及呆滞数据、SKU 数）有关，与库存总行数无关
+DEFAULT_BATCH_SIZE = 50_000
+
+
+class ReportAccumulator:
+    """
+    逐批累加各明细表的数据：明细行按分类追加到临时文件，合计与汇总数据同步累加
+    用法：
+        with ReportAccumulator() as acc:
+            for detail in batches:
+                acc.add(detail)
+            acc.write(output, df2)
+    """
+
+    def __init__(self, directory=None):
+        """
+        :param directory: 临时文件目录，默认使用系统临时目录
+        """
+        self._tmp = tempfile.TemporaryDirectory(dir=directory)
+        n_sheets, n_categories = len(dp.SHEET_BITS), len(dp.CATEGORY_ORDER)
+        self._spools = [[None] * n_categories for _ in range(n_sheets)]
+        self.counts = np.zeros(n_sheets, dtype=np.int64)
+        # 各表合计行：库存总件数、数量
+        self.totals = [[0, 0] for _ in range(n_sheets)]
+        # 汇总数据：各数据集（顺序同 cube.DATASETS，第一项为明细汇总）每个分类的 产品编码 集合、件数与数量
+        self.skus = [[set() for _ in range(n_categories)] for _ in DATASETS]
+        self.pieces = [[0] * n_categories for _ in DATASETS]
+        self.quantity = [[0] * n_categories for _ in DATASETS]
+        self.sample = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for spools in self._spools:
+            for f in spools:
+                if f is not None:
+                    f.close()
+        self._tmp.cleanup()
+
+    def _spool(self, sheet, category):
+        if self._spools[sheet][category] is None:
+            path = os.path.join(self._tmp.name, f'{sheet}_{category}.pkl')
+            self._spools[sheet][category] = open(path, 'w+b')
+        return self._spools[sheet][category]
+
+    def add(self, detail):
+        """
+        累加一批 sort_and_filter 之前、已选好明细列的数据
+        :param detail: 列为 dp.detail_columns() 的 DataFrame
+        """
+        if self.sample is None:
+            self.sample = detail.iloc[:0]
+        codes = dp.route_sheets(detail)
+        category_codes = pd.Categorical(detail['分类'], categories=dp.CATEGORY_ORDER).codes
+        for sheet, bit in enumerate(dp.SHEET_BITS.values()):
+            in_sheet = (codes & bit) != 0
+            if not in_sheet.any():
+                continue
+            part = detail[in_sheet]
+            part_categories = category_codes[in_sheet]
+            self.counts[sheet] += len(part)
+            self.totals[sheet][0] += part['库存总件数'].sum()
+            self.totals[sheet][1] += part['数量'].sum()
+            for category in np.unique(part_categories[part_categories >= 0]):
+                rows = part[part_categories == category]
+                pickle.dump(rows, self._spool(sheet, category), protocol=pickle.HIGHEST_PROTOCOL)
+                skus = pd.unique(np.asarray(rows['产品编码'].dropna(), dtype=object))
+                pieces = rows['库存总件数'].sum()
+                quantity = rows['数量'].sum()
+                for target in (0, sheet + 1):
+                    self.skus[target][category].update(skus)
+                    self.pieces[target][category] += pieces
+                    self.quantity[target][category] += quantity
+
+    def _rows(self, sheet):
+        """
+        按分类顺序读回某个明细表的全部批次
+        """
+        for f in self._spools[sheet]:
+            if f is None:
+                continue
+            f.seek(0)
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+
+    def cube(self):
+        """
+        与 cube.build_cube(frames) 相同格式的汇总立方体
+        """
+        return pd.DataFrame({
+            '数据集': pd.Categorical(np.repeat(DATASETS, len(dp.CATEGORY_ORDER)), categories=DATASETS, ordered=True),
+            '分类': pd.Categorical(dp.CATEGORY_ORDER * len(DATASETS), categories=dp.CATEGORY_ORDER, ordered=True),
+            'SKU个数': [len(skus) for sheet in self.skus for skus in sheet],
+            '件数': [pieces for sheet in self.pieces for pieces in sheet],
+            '数量': [quantity for sheet in self.quantity for quantity in sheet],
+        })
+
+    def chunks(self, sheet):
+        """
+        某个明细表的数据块：各批次按分类顺序读回，最后为合计行
+        """
+        sample = self.sample if self.sample is not None else pd.DataFrame(columns=dp.DETAIL_COLUMNS)
+        yield from self._rows(sheet)
+        yield pd.DataFrame([{'产品说明': '合计', '库存总件数': self.totals[sheet][0],
+                             '数量': self.totals[sheet][1]}], columns=sample.columns)
+
+    def write(self, output, df2, export_format=DEFAULT_FORMAT):
+        """
+        写出报表，内容与工作表顺序与 excel_export.to_excel 相同
+        :param output: 文件路径或二进制文件对象
+        :param df2: 异常类别定义
+        :param export_format: 导出格式，见 exporters.EXPORTERS
+        """
+        materials = [(sheet_name, self.chunks(sheet)) for sheet, sheet_name in enumerate(MATERIAL_SHEET_NAMES)]
+        get_exporter(export_format).write(output, self.cube(), df2, materials)
+
+
+def process_batch(df1, index, date_value, cp_warehouses):
+    """
+    处理一批库存数据，返回明细列（未排序、未分表）
+    :param index: 呆滞数据的 KeyIndex
+    """
+    df_res, _ = dp.read_data(df1, index.df, cp_warehouses)
+    df_res = dp.apply_schema(df_res)
+    df_res = dp.calculate_expiry(df_res, date_value, keep_dates=True)
+    df_res = dp.expiry_classification(df_res)
+    df_res = dp.merge_and_mark(df_res, index)
+    df_res = dp.classify_items(df_res)
+    df_res = dp.filter_and_calculate(df_res)
+    columns = dp.detail_columns(df_res)
+    return dp.reorder_columns(df_res, columns)[columns]
+
+
+def build_report_chunked(batches, df2, date_value, cp_warehouses, output=None, profiler=None, spool_dir=None,
+                         history=None, delta=False, export_format=DEFAULT_FORMAT):
+    """
+    分批处理库存数据并生成 Excel 报表，结果与 pipeline.build_report 相同
+    （同一分类内的行按输入顺序排列）
+    :param batches: 库存数据的批次（DataFrame 的可迭代对象，如 ingest.iter_inventory 的返回值）
+    :param df2: 呆滞数据（一次读入）
+    :param output: 文件路径或二进制文件对象；为 None 时返回报表文件的字节串
+    :param spool_dir: 暂存明细的临时目录
+    :param history: HistoryStore，指定时各批明细写入该月的历史数据（第一批覆盖同月已有数据）
+    :param delta: 为 True 时明细只写入历史数据，不暂存，报表只包含与上一个月份相比的变化（见 delta），需要 history
+    :param export_format: 导出格式，见 exporters.EXPORTERS
+    :return: (报表文件的字节串（指定 output 时为 None）, 汇总立方体（变化报表为 None）)，同 pipeline.build_outputs
+    """
+    if delta and history is None:
+        raise ValueError("变化报表需要历史数据目录")
+    profiler = profiler if profiler is not None else StageProfiler(enabled=False)
+    with pd.option_context('mode.copy_on_write', True):
+        _, df2_res = dp.read_data(pd.DataFrame(columns=ingest.INVENTORY_COLUMNS), df2, cp_warehouses)
+        index = KeyIndex(dp.apply_schema(df2_res), ['产品编码', '批次号', '所在仓库'])
+        with ReportAccumulator(spool_dir) as acc:
+            for n, df1 in enumerate(batches):
+                detail = profiler.run('process_batch', process_batch, df1, index, date_value, cp_warehouses)
+                if not delta:
+                    profiler.run('spool_batch', acc.add, detail)
+                if history is not None:
+                    profiler.run('append_history', history.append, detail, date_value, replace=n == 0)
+            target = BytesIO() if output is None else output
+            if delta:
+                changes, base_month = profiler.run('compare_history', build_delta, history, date_value)
+                profiler.run('to_excel', delta_to_excel, changes, base_month, month_of(date_value),
+                             dp.generate_description_df(), target)
+            else:
+                profiler.run('to_excel', acc.write, target, dp.generate_description_df(), export_format)
+            cube = None if delta else acc.cube()
+    return (target.getvalue() if output is None else None), cube
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+import dataprocess as dp
+
+# 汇总数据立方体：数据集（明细汇总 + 各明细表）× 分类（× 可选维度）的 SKU个数（产品编码去重）、件数、数量，
+# 由分表后的明细一次聚合得到，汇总数据表、页面预览和按 仓库分类/所在仓库 的透视共用
+
+# 各明细表在汇总数据中的名称，顺序同 dataprocess.SHEET_BITS
+SUMMARY_NAMES = ['口腔数据', '洗护数据', '电商数据', '促销品&非卖数据', '拓展部数据', '齿说数据']
+TOTAL_NAME = '汇总'
+DATASETS = [TOTAL_NAME] + SUMMARY_NAMES
+MEASURES = ['SKU个数', '件数', '数量']
+
+
+def _sum_by(key, values, size):
+    """
+    按组合键求和，整数列保持整数，空值不计
+    """
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return np.bincount(key, weights=values.astype(np.float64), minlength=size).round().astype(np.int64)
+    return np.bincount(key, weights=np.nan_to_num(values.astype(np.float64)), minlength=size)
+
+
+def _codes(frames, col):
+    """
+    各表某列的整数编码（空值为 -1）与取值；各表为相同类别的分类类型时直接使用类别编码
+    """
+    columns = [df[col] for df in frames]
+    dtypes = [column.dtype for column in columns]
+    if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes) and all(
+            dtype == dtypes[0] for dtype in dtypes):
+        codes = np.concatenate([column.cat.codes.to_numpy(dtype=np.int64) for column in columns])
+        return codes, dtypes[0].categories
+    return pd.factorize(np.concatenate([np.asarray(column, dtype=object) for column in columns]))
+
+
+def build_cube(frames, by=None):
+    """
+    一次聚合各明细表
+    :param frames: 各明细表（filter_special_cases 的结果，顺序同 SUMMARY_NAMES），合计行（分类为空）不计入
+    :param by: 附加维度，如 '仓库分类' 或 '所在仓库'，默认只按 分类
+    :return: 长表，列为 数据集、分类、[by]、SKU个数、件数、数量；每个数据集都包含全部分类
+    """
+    n_classes = len(dp.CATEGORY_ORDER)
+    sheet_ids = np.concatenate([np.full(len(df), k, dtype=np.int64) for k, df in enumerate(frames, start=1)])
+    class_codes = np.concatenate([pd.Categorical(df['分类'], categories=dp.CATEGORY_ORDER).codes for df in frames])
+    sku_codes, skus = _codes(frames, '产品编码')
+    if by is None:
+        group_codes, groups = np.zeros(len(sheet_ids), dtype=np.int64), None
+    else:
+        group_codes, groups = _codes(frames, by)
+    n_groups = 1 if groups is None else len(groups)
+    # 只统计已归类的行；分组维度为空的行不计入
+    keep = (class_codes >= 0) & (group_codes >= 0)
+    sheet_ids, class_codes, sku_codes, group_codes = (
+        sheet_ids[keep], class_codes[keep], sku_codes[keep], group_codes[keep])
+    size = len(DATASETS) * n_classes * n_groups
+    # 组合键：数据集 × 分类 × 维度；明细汇总（数据集 0）的件数、数量为各表之和，SKU 在所有表中去重
+    key = (sheet_ids * n_classes + class_codes) * n_groups + group_codes
+    total_key = class_codes * n_groups + group_codes
+    measures = {}
+    for name, col in (('件数', '库存总件数'), ('数量', '数量')):
+        values = np.concatenate([df[col].to_numpy() for df in frames])[keep]
+        sums = _sum_by(key, values, size)
+        sums[:n_classes * n_groups] = sums.reshape(len(DATASETS), -1)[1:].sum(axis=0)
+        measures[name] = sums
+    n_skus = max(len(skus), 1)
+    valid = sku_codes >= 0
+    pairs = np.unique(np.concatenate([key[valid], total_key[valid]]) * n_skus
+                      + np.concatenate([sku_codes[valid], sku_codes[valid]]))
+    sku_count = np.bincount(pairs // n_skus, minlength=size)
+
+    levels = [pd.CategoricalIndex(DATASETS, categories=DATASETS, ordered=True),
+              pd.CategoricalIndex(dp.CATEGORY_ORDER, categories=dp.CATEGORY_ORDER, ordered=True)]
+    names = ['数据集', '分类']
+    if groups is not None:
+        levels.append(pd.Index(groups))
+        names.append(by)
+    index = pd.MultiIndex.from_product(levels, names=names)
+    cube = pd.DataFrame({'SKU个数': sku_count, '件数': measures['件数'], '数量': measures['数量']}, index=index)
+    return cube.reset_index()
+
+
+def pivot(cube, values='SKU个数', index='数据集', columns='分类', dataset=TOTAL_NAME):
+    """
+    透视立方体，如 pivot(build_cube(frames, by='仓库分类'), '件数', index='仓库分类')
+    :param dataset: 行列都不含 数据集 时取哪个数据集，默认明细汇总
+    """
+    if '数据集' not in (index, columns):
+        cube = cube[cube['数据集'] == dataset]
+    return cube.pivot_table(index=index, columns=columns, values=values, aggfunc='sum', observed=True)
+
+
+def summary_tables(cube):
+    """
+    汇总数据表各块：{数据集: DataFrame(分类, SKU个数, 件数)}
+    :param cube: 只按 分类 聚合的立方体（SKU个数 不能跨维度相加）
+    """
+    extra = [col for col in cube.columns if col not in ['数据集', '分类'] + MEASURES]
+    if extra:
+        raise ValueError(f"汇总数据只能由按 分类 聚合的立方体生成，多余维度：{extra}")
+    results = {}
+    for name, block in cube.groupby('数据集', observed=False, sort=True):
+        block = block[['分类', 'SKU个数', '件数']].reset_index(drop=True)
+        block['分类'] = block['分类'].astype(object)
+        results[name] = block
+    return results
@@ -0,0 +1,27 @@
+import os
+
+# 本地数据目录：历史明细、动销索引等需要长期保存的数据默认放在项目目录下的 data/，
+# 可用环境变量 JKPMC_DATA_DIR 指定其他位置（各存储也可在 secrets 中单独配置目录）
+DATA_DIRECTORY = os.environ.get('JKPMC_DATA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def data_directory(name):
+    """
+    数据目录下的子目录路径（不创建目录）
+    :param name: 子目录名，如 'history'
+    """
+    return os.path.join(DATA_DIRECTORY, name)
+
+
+def private_directory(directory):
+    """
+    创建只有当前用户可访问的目录（0o700），用于存放会被 pickle 读取的文件；
+    已存在的目录不属于当前用户或其他用户可写时拒绝使用，避免读取他人放入的文件
+    :return: directory
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'):
+        status = os.stat(directory)
+        if status.st_uid != os.getuid() or status.st_mode & 0o022:
+            raise ValueError(f"目录 {directory} 不属于当前用户或其他用户可写，不能用于保存缓存数据")
+    return directory
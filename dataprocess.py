@@ -1,7 +1,7 @@
 import numpy as np
 import pandas as pd
-import streamlit as st
 from datetime import datetime
+from keyindex import KeyIndex, normalized_column
 
 # 数据处理函数封装功能
 def generate_description_df():
@@ -21,10 +21,22 @@ def generate_description_df():
     return df2
 
 
-def read_data(df1, df2):
-    cp_warehouses = dict(st.secrets["ccp_warehouse"])
+# 多个文件合并处理时记录每行来自哪个文件，明细表中放在最后一列
+SOURCE_COLUMN = '来源文件'
+
+
+def read_data(df1, df2, cp_warehouses=None):
+    """
+    :param cp_warehouses: 所在仓库 → 仓库分类 的映射，默认读取 st.secrets["ccp_warehouse"]
+    """
+    if cp_warehouses is None:
+        # 仅在未传入映射时才引入 streamlit，命令行/批处理不依赖 streamlit
+        import streamlit as st
+        cp_warehouses = st.secrets["ccp_warehouse"]
+    cp_warehouses = dict(cp_warehouses)
     df2_res = df2[['产品编码', '批次号', '所在仓库']]
-    df1 = df1[['产品说明', '产品编码', '品规', '库存总件数(销售可用+零货+破损+冻结)', '批次', '失效日期','生产日期', '所在仓库']]
+    columns = ['产品说明', '产品编码', '品规', '库存总件数(销售可用+零货+破损+冻结)', '批次', '失效日期','生产日期', '所在仓库']
+    df1 = df1[columns + [SOURCE_COLUMN] if SOURCE_COLUMN in df1.columns else columns]
     df1 = df1.rename(columns={'库存总件数(销售可用+零货+破损+冻结)': '库存总件数'})
     df1 = df1.rename(columns={'批次': '批次号'})
     df1['仓库分类'] = df1['所在仓库'].map(cp_warehouses)
@@ -39,29 +51,89 @@ def read_data(df1, df2):
     return df_res,df2_res
 
 
-def calculate_expiry(df, date_value):
-    df = df.copy()
+# 明细数据的列类型声明：文本键列为分类类型，件数类列为整数时下调精度，日期列保持 datetime64 直到导出
+SCHEMA_CATEGORY_COLUMNS = ['产品编码', '批次号', '所在仓库', '仓库分类']
+SCHEMA_NUMERIC_COLUMNS = ['品规', '库存总件数']
+SCHEMA_DATE_COLUMNS = ['失效日期', '生产日期', '入库日期']
+
+
+def apply_schema(df):
+    """
+    按类型声明转换 read_data 返回的数据（库存数据或呆滞数据），只转换存在的列
+    """
+    df = df.copy(deep=False)
+    for col in SCHEMA_CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in SCHEMA_NUMERIC_COLUMNS:
+        if col in df.columns:
+            values = pd.to_numeric(df[col])
+            # 小数（零货件数）或有空值的列保持 float64，下调为 float32 会改变导出和汇总的数值
+            df[col] = pd.to_numeric(values, downcast='integer') if values.dtype.kind in 'iu' else values.astype(np.float64)
+    for col in SCHEMA_DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col])
+    return df
+
+
+def calculate_quantity(df):
+    """
+    数量 = 品规 × 库存总件数；下调精度后的整数列先提升为 64 位再相乘，避免溢出
+    """
+    spec, pieces = df['品规'], df['库存总件数']
+    if spec.dtype.kind in 'iu' and pieces.dtype.kind in 'iu':
+        return spec.astype(np.int64, copy=False) * pieces.astype(np.int64, copy=False)
+    return spec * pieces
+
+
+def calculate_expiry(df, date_value, keep_dates=False):
+    """
+    :param keep_dates: 为 True 时 失效日期/生产日期 保持 datetime64（导出时按日期格式写入），否则转为 'YYYY-MM-DD' 字符串
+    """
+    df = df.copy(deep=False)
     df['失效日期'] = pd.to_datetime(df['失效日期'])
     df['生产日期'] = pd.to_datetime(df['生产日期'])
     date_value = pd.to_datetime(date_value)
     df['效期'] = (df['失效日期'] - df['生产日期']).dt.days
     df['剩余效期天数'] = (df['失效日期'] - date_value).dt.days
     df['%(剩余效期/总效期)'] = df['剩余效期天数'] / df['效期']
-    df['失效日期'] = df['失效日期'].dt.strftime('%Y-%m-%d')
-    df['生产日期'] = df['生产日期'].dt.strftime('%Y-%m-%d')
+    if not keep_dates:
+        df['失效日期'] = df['失效日期'].dt.strftime('%Y-%m-%d')
+        df['生产日期'] = df['生产日期'].dt.strftime('%Y-%m-%d')
     return df
 
 
-def expiry_classification(df):
-    df = df.copy()
+# 效期类别与异常分类的规则表，顺序即优先级
+EXPIRY_CATEGORIES = ["过效期", "剩余1/3效期", "剩余2/3效期", ""]
+CATEGORY_ORDER = ['过期货', '呆滞品', '临期货', '预警货']
+STALE_FLAG = '≥180天无动销'
+# 分类判定表：行为是否呆滞(0/1)，列为效期类别编码(过效期、1/3、2/3、其余、缺失)，值为 CATEGORY_ORDER 编码，-1 表示不归类
+# 优先级：过期货 > 呆滞品 > 临期货 > 预警货
+CLASSIFICATION_TABLE = np.array([
+    [0, 2, 3, -1, -1],
+    [0, 1, 1, 1, 1],
+], dtype=np.int8)
+
+
+def expiry_codes(ratio):
+    """
+    按 %(剩余效期/总效期) 计算效期类别编码（对应 EXPIRY_CATEGORIES 下标）
+    """
+    ratio = np.asarray(ratio, dtype=float)
     conditions = [
-        (df['%(剩余效期/总效期)'] <= 0),
-        (df['%(剩余效期/总效期)'] <= 1 / 3) & (df['%(剩余效期/总效期)'] > 0),
-        (df['%(剩余效期/总效期)'] > 1 / 3) & (df['%(剩余效期/总效期)'] <= 2 / 3),
-        (df['%(剩余效期/总效期)'] > 2 / 3)
+        ratio <= 0,
+        (ratio <= 1 / 3) & (ratio > 0),
+        (ratio > 1 / 3) & (ratio <= 2 / 3),
+        ratio > 2 / 3
     ]
-    choices = ["过效期", "剩余1/3效期", "剩余2/3效期", ""]
-    df['效期类别'] = np.select(conditions, choices, default="")
+    # 缺失值不满足任何条件，与原逻辑一致归为 ""
+    return np.select(conditions, [0, 1, 2, 3], default=3).astype(np.int8)
+
+
+def expiry_classification(df):
+    df = df.copy(deep=False)
+    codes = expiry_codes(df['%(剩余效期/总效期)'])
+    df['效期类别'] = pd.Categorical.from_codes(codes, categories=EXPIRY_CATEGORIES)
     return df
 
 
@@ -74,86 +146,59 @@ def merge_and_mark(df1, df2, key_cols=['产品编码', '批次号', '所在仓
     
     参数：
     - df1: 主数据表（需要标记和追加列的表）
-    - df2: 无动销清单表（用于匹配的表）
+    - df2: 无动销清单表（用于匹配的表），也可以是已建好的 KeyIndex，多次匹配时只建一次索引
     - key_cols: 匹配关键字段（默认：产品编码、批次号、所在仓库）
     
     返回：
-    - df1_copy: df1的副本，包含新增的"180天无动销"列+df2的所有列
+    - result_df: df1的浅拷贝，关键字段统一格式，包含新增的"180天无动销"列+df2的所有列
     """
-    # ========== 步骤1：数据校验 ==========
-    for df, name in [(df1, 'df1'), (df2, 'df2')]:
-        missing_cols = [col for col in key_cols if col not in df.columns]
-        if missing_cols:
-            raise ValueError(f"{name} 缺少关键字段：{missing_cols}")
-    
-    # ========== 步骤2：创建副本，保护原数据 ==========
-    df1_copy = df1.copy(deep=True)
-    df2_copy = df2.copy(deep=True)
-    
-    # ========== 步骤3：统一关键字段格式（避免类型/空格问题） ==========
+    # ========== 步骤1：建立索引（关键字段统一格式+编码，同一组合只保留第一行） ==========
+    index = df2 if isinstance(df2, KeyIndex) else KeyIndex(df2, key_cols)
+    key_cols = index.key_cols
+
+    # ========== 步骤2：按索引批量查找，不复制df1的数据 ==========
+    positions, complete = index.lookup(df1)
+    result_df = df1.copy(deep=False)
+    result_df.index = pd.RangeIndex(len(result_df))
     for col in key_cols:
-        # 转字符串+去空格+空值统一为NaN
-        df1_copy[col] = df1_copy[col].astype(str).str.strip().replace(['nan', ''], np.nan)
-        df2_copy[col] = df2_copy[col].astype(str).str.strip().replace(['nan', ''], np.nan)
-    
-    # ========== 步骤4：处理df2 - 去重+保留所有列（避免一对多匹配） ==========
-    # 按关键字段去重，保留第一行（确保每个组合只匹配一次）
-    df2_unique = df2_copy.drop_duplicates(subset=key_cols, keep='first')
-    
-    # ========== 步骤5：左连接匹配 - 同步df2的所有列到df1 ==========
-    # 用suffixes避免列名重复（比如df1和df2都有"备注"列时，df2的列会变成"备注_df2"）
-    merged_df = df1_copy.merge(
-        df2_unique,
-        on=key_cols,
-        how='left',
-        indicator=True,
-        suffixes=('', '_df2')
-    )
-    # ========== 步骤6：标记"≥180天无动销"（仅交集行） ==========
-    # 规则：关键字段无空值 + 匹配成功（_merge=both）才标记
-    merged_df['180天无动销'] = np.where(
-        (merged_df['_merge'] == 'both') & 
-        (~merged_df[key_cols].isna().any(axis=1)),
-        '≥180天无动销',
-        None
-    )
-    # ========== 步骤7：整理结果 - 移除_merge列，返回最终df1 ==========
-    # 移除_merge列（临时标记列）
-    result_df = merged_df.drop(columns=['_merge'])
+        result_df[col] = normalized_column(df1, col)
+
+    # ========== 步骤3：追加df2的其余列（列名重复时df2的列加后缀"_df2"） ==========
+    for col, values in index.take(positions).items():
+        name = f"{col}_df2" if col in result_df.columns else col
+        result_df[name] = values
+
+    # ========== 步骤4：标记"≥180天无动销"（仅交集行） ==========
+    # 规则：关键字段无空值 + 匹配成功才标记
+    result_df['180天无动销'] = np.where((positions >= 0) & complete, STALE_FLAG, None)
     return result_df
 
 
 def classify_items(df):
-    df = df.copy()
-    df['分类'] = ""
-
-    def assign_classification(row):
-        classification = []
-        if row['效期类别'] == '过效期':
-            classification.append('过期货')
-        elif row['180天无动销'] == '≥180天无动销':
-            classification.append('呆滞品')
-        elif row['效期类别'] == '剩余1/3效期' and row['180天无动销']!= '≥180天无动销':
-            classification.append('临期货')
-        elif row['效期类别'] == '剩余2/3效期' and row['180天无动销']!= '≥180天无动销':
-            classification.append('预警货')
-        return ', '.join(classification)
-
-    df['分类'] = df.apply(assign_classification, axis=1)
+    """
+    按优先级（过期货 > 呆滞品 > 临期货 > 预警货）整列判定分类，结果为有序分类类型，不归类的行为空值
+    """
+    df = df.copy(deep=False)
+    expiry = pd.Categorical(df['效期类别'], categories=EXPIRY_CATEGORIES).codes
+    # 缺失或未知的效期类别编码为 -1，对应判定表最后一列
+    expiry = np.where(expiry < 0, len(EXPIRY_CATEGORIES), expiry)
+    stale = (df['180天无动销'] == STALE_FLAG).to_numpy(dtype=np.int8)
+    codes = CLASSIFICATION_TABLE[stale, expiry]
+    df['分类'] = pd.Categorical.from_codes(codes, categories=CATEGORY_ORDER, ordered=True)
     return df
 
 
 def filter_and_calculate(df):
-    df = df.copy()
-    df = df[~(df['分类'] == "")]
+    quantity = calculate_quantity(df)
+    # 已归类且数量为正的行，只筛选一次
+    keep = df['分类'].notna() & (df['分类'] != "") & (quantity > 0)
+    df = df[keep].copy(deep=False)
     df['处理方案'] = None
-    df.loc[:, '数量'] = df['品规'] * df['库存总件数']
-    df = df[df['数量'] > 0]
+    df['数量'] = quantity[keep]
     return df
 
 
 def reorder_columns(df, columns_to_front):
-    df = df.copy()
     all_columns = df.columns.tolist()
     for col in columns_to_front:
         if col not in all_columns:
@@ -163,29 +208,39 @@ def reorder_columns(df, columns_to_front):
     return df
 
 
+# 明细表保留的列及顺序
+DETAIL_COLUMNS = [
+    "分类",
+    "处理方案",
+    "效期类别",
+    "180天无动销",
+    "%(剩余效期/总效期)",
+    "剩余效期天数",
+    "产品说明",
+    "品规",
+    "库存总件数",
+    "数量",
+    "产品编码",
+    "批次号",
+    "失效日期",
+    "所在仓库",
+    "仓库分类"
+]
+
+
+def detail_columns(df):
+    """
+    明细表的列：DETAIL_COLUMNS，有来源文件列时加在最后
+    """
+    return DETAIL_COLUMNS + [SOURCE_COLUMN] if SOURCE_COLUMN in df.columns else DETAIL_COLUMNS
+
+
 def sort_and_filter(df):
-    category_order = ['过期货', '呆滞品', '临期货', '预警货']
-    df['分类'] = pd.Categorical(df['分类'], categories=category_order, ordered=True)
+    cols_to_keep = detail_columns(df)
+    # 先取需要的列再排序，只对保留的列重排
+    df = reorder_columns(df, cols_to_keep)[cols_to_keep]
+    df['分类'] = pd.Categorical(df['分类'], categories=CATEGORY_ORDER, ordered=True)
     df = df.sort_values(by='分类')
-    cols_to_keep = [
-        "分类",
-        "处理方案",
-        "效期类别",
-        "180天无动销",
-        "%(剩余效期/总效期)",
-        "剩余效期天数",
-        "产品说明",
-        "品规",
-        "库存总件数",
-        "数量",
-        "产品编码",
-        "批次号",
-        "失效日期",
-        "所在仓库",
-        "仓库分类"
-    ]
-    df = df[cols_to_keep]
-    df = reorder_columns(df, cols_to_keep)
     return df
 
 
@@ -198,28 +253,81 @@ def append_sum_row(df):
     res = pd.concat([df, pd.DataFrame([summary_row])], ignore_index=True)
     return res
 
+def _contains(series, pattern, regex=False):
+    """
+    按去重后的取值做 str.contains，再映射回每一行（空值为 False）
+    """
+    codes, uniques = pd.factorize(series)
+    matched = pd.Series(uniques, dtype=object).str.contains(pattern, na=False, regex=regex).to_numpy(dtype=bool)
+    # 编码 -1（空值）取到末尾追加的 False
+    return np.append(matched, False)[codes]
+
+
+# 明细表路由：第 k 位对应 filter_special_cases 返回的第 k 个表，一行可同时属于多个表
+SHEET_BITS = {
+    'df_s11': 1,  # 正常品种销售-口腔
+    'df_s12': 2,  # 正常品种销售-洗护
+    'df_s2': 4,   # 电商
+    'df_s3': 8,   # 促销品&非卖
+    'df_s4': 16,  # 客户拓展部
+    'df_s5': 32,  # 齿说产品
+}
+
+
+def route_sheets(df):
+    """
+    一次计算每行所属的明细表，文本条件只对去重后的 产品说明/所在仓库 求值
+    :return: 每行的路由编码（SHEET_BITS 按位或）
+    """
+    category = df["仓库分类"].to_numpy(dtype=object)
+    cond1 = category == "促销品"
+    cond2 = category == "非卖品"
+    pattern = r'(?<!\d)15g(?!\d)'
+    cond3 = _contains(df["产品说明"], pattern, regex=True)
+    cond4 = _contains(df["产品说明"], "牙膏")
+    cond5 = _contains(df["产品说明"], "达那卡")
+    cond6 = _contains(df["产品说明"], "齿说")
+    cond7 = _contains(df['所在仓库'], '口腔|器械', regex=True) # 包含 "口腔" 或 "器械" 的仓库
+    cond8 = _contains(df['所在仓库'], '洗护')
+    cond9 = category == "正常品种销售"
+    expansion = (cond3 & cond4) | cond5
+    regular = ~(cond6 | expansion)
+    codes = np.zeros(len(df), dtype=np.int8)
+    codes |= np.where(cond9 & cond7 & regular, SHEET_BITS['df_s11'], 0).astype(np.int8)
+    codes |= np.where(cond9 & cond8 & regular, SHEET_BITS['df_s12'], 0).astype(np.int8)
+    codes |= np.where((category == "电商") & regular, SHEET_BITS['df_s2'], 0).astype(np.int8)
+    codes |= np.where((cond1 | cond2) & regular, SHEET_BITS['df_s3'], 0).astype(np.int8)
+    codes |= np.where(expansion, SHEET_BITS['df_s4'], 0).astype(np.int8)
+    codes |= np.where(cond6, SHEET_BITS['df_s5'], 0).astype(np.int8)
+    return codes
+
+
 def filter_special_cases(df):
     """
     根据特定条件筛选 DataFrame
     :param df: 输入的 DataFrame
-    :return: 筛选后的多个 DataFrame
+    :return: 筛选后的多个 DataFrame（各带一行合计）
     """
-    cond1 = df["仓库分类"] == "促销品"
-    cond2 = df["仓库分类"] == "非卖品"
-    pattern = r'(?<!\d)15g(?!\d)'
-    cond3 = df["产品说明"].str.contains(pattern, na=False, regex=True)
-    cond4 = df["产品说明"].str.contains("牙膏", na=False)
-    cond5 = df["产品说明"].str.contains("达那卡", na=False)
-    cond6 = df["产品说明"].str.contains("齿说", na=False)
-    cond7 = df['所在仓库'].str.contains('口腔|器械', na=False) # 包含 "口腔" 或 "器械" 的仓库
-    cond8 = df['所在仓库'].str.contains('洗护', na=False)
-    cond9 = df["仓库分类"] == "正常品种销售"
-    df_s11 = append_sum_row(df[(cond9 & cond7) & (~(cond6 |((cond3 & cond4) | cond5) ))]) # df_s11 = append_sum_row(df[cond9 & cond7])
-    df_s12 = append_sum_row(df[(cond9 & cond8) & (~(cond6 |((cond3 & cond4) | cond5) ))])
-    df_s2 = append_sum_row(df[(df["仓库分类"] == "电商") & (~(cond6 |((cond3 & cond4) | cond5) ))])
-    df_s3 = append_sum_row(df[(cond1 | cond2) & (~(cond6 |((cond3 & cond4) | cond5) ))])
-    df_s4 = append_sum_row(df[(cond3 & cond4) | cond5]) # 客户拓展部
-    df_s5 = append_sum_row(df[cond6]) # 齿说产品
+    codes = route_sheets(df)
+    # 各表合计：按路由编码分组求和一次，再按位汇总到各表
+    sums = df[['库存总件数', '数量']].groupby(codes).sum()
+    summary_rows = []
+    for bit in SHEET_BITS.values():
+        part = sums[(sums.index.to_numpy() & bit) != 0]
+        summary_rows.append({
+            '产品说明': '合计',
+            '库存总件数': part['库存总件数'].sum(),
+            '数量': part['数量'].sum()
+        })
+    # 明细与合计行只拼接一次，各表按行号取出
+    combined = pd.concat([df, pd.DataFrame(summary_rows)], ignore_index=True)
+    frames = []
+    for k, bit in enumerate(SHEET_BITS.values()):
+        positions = np.append(np.flatnonzero(codes & bit), len(df) + k)
+        frame = combined.take(positions)
+        frame.index = pd.RangeIndex(len(frame))
+        frames.append(frame)
+    df_s11, df_s12, df_s2, df_s3, df_s4, df_s5 = frames
 
     return df_s11, df_s12, df_s2, df_s3, df_s4, df_s5
 
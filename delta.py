@@ -0,0 +1,119 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from excel_export import (StyleSet, DESCRIPTION_SHEET_NAME, start_material_sheet, append_material_rows,
+                          write_description_sheet)
+from history import KEY_COLUMNS, month_of
+
+# 月度变化报表：本月明细与历史数据中上一个月份按 (产品编码, 批次号, 所在仓库) 比较，
+# 只输出新增、消失、分类或数量有变化的键；未变化的键不再导出，本月的完整状态仍保存在历史数据中
+NEW = '新增'
+GONE = '消失'
+CATEGORY_CHANGED = '分类变化'
+QUANTITY_CHANGED = '数量变化'
+CHANGE_TYPES = [NEW, GONE, CATEGORY_CHANGED, QUANTITY_CHANGED]
+CHANGE_COLUMN = '变化类型'
+CHANGE_SUMMARY_SHEET_NAME = '变化汇总'
+CHANGE_SHEET_NAME = '变化明细'
+# 比较和输出用到的列（每个键一行，见 history.by_key）
+STATE_COLUMNS = ['仓库分类', '产品说明', '分类', '库存总件数', '数量']
+
+
+def compare(current, previous):
+    """
+    比较两个月份每个键的状态
+    :param current: 本期，history.by_key 的结果，列为 KEY_COLUMNS + STATE_COLUMNS
+    :param previous: 上期，格式同上
+    :return: 有变化（新增、消失、分类变化、件数或数量变化）的键：变化类型、关键字段、仓库分类、产品说明、
+             上期/本期分类、上期/本期件数、上期/本期数量、数量变化，按变化类型、关键字段排序；
+             分类和数量都变化时记为分类变化
+    """
+    merged = previous.merge(current, on=KEY_COLUMNS, how='outer', suffixes=('_上期', '_本期'), indicator=True)
+    before, after = merged['分类_上期'], merged['分类_本期']
+    category_changed = (before.astype(object) != after.astype(object)).to_numpy() & before.notna().to_numpy()
+    # 件数或数量有变化
+    quantity_changed = np.zeros(len(merged), dtype=bool)
+    for col in ('库存总件数', '数量'):
+        quantity_changed |= ~np.isclose(np.nan_to_num(merged[f'{col}_上期'].to_numpy(dtype=np.float64)),
+                                        np.nan_to_num(merged[f'{col}_本期'].to_numpy(dtype=np.float64)))
+    change = np.select(
+        [merged['_merge'].to_numpy() == 'right_only', merged['_merge'].to_numpy() == 'left_only',
+         category_changed, quantity_changed],
+        CHANGE_TYPES, default='')
+    merged[CHANGE_COLUMN] = pd.Categorical(change, categories=CHANGE_TYPES, ordered=True)
+    changes = merged[merged[CHANGE_COLUMN].notna()]
+    result = pd.DataFrame({CHANGE_COLUMN: changes[CHANGE_COLUMN]})
+    for col in KEY_COLUMNS:
+        result[col] = changes[col]
+    # 消失的键取上期的 仓库分类、产品说明
+    for col in ('仓库分类', '产品说明'):
+        result[col] = changes[f'{col}_本期'].fillna(changes[f'{col}_上期'])
+    for col in ('分类', '库存总件数', '数量'):
+        result[f'上期{col}'] = changes[f'{col}_上期']
+        result[f'本期{col}'] = changes[f'{col}_本期']
+    result['数量变化'] = result['本期数量'].fillna(0) - result['上期数量'].fillna(0)
+    return result.sort_values([CHANGE_COLUMN] + KEY_COLUMNS, ignore_index=True)
+
+
+def build_delta(history, date_value, base_month=None):
+    """
+    由历史数据得到本月与上期的变化（本月明细需已写入历史数据）；两个月份都只读取关键字段和 STATE_COLUMNS
+    :param history: HistoryStore
+    :param base_month: 比较的月份，默认为早于本月的最近一个已保存月份
+    :return: (变化明细, 上期月份)
+    """
+    month = month_of(date_value)
+    base_month = base_month or history.previous_month(month)
+    if base_month is None:
+        raise ValueError(f"历史数据中没有早于 {month} 的月份，无法生成变化报表")
+    current = history.snapshot(month, STATE_COLUMNS)
+    previous = history.snapshot(base_month, STATE_COLUMNS)
+    return compare(current, previous), base_month
+
+
+def summarize_changes(changes):
+    """
+    变化汇总：各变化类型的键数、件数变化、数量变化，及上期 → 本期分类的键数
+    """
+    by_type = changes.groupby(CHANGE_COLUMN, observed=False).agg(
+        键数=('产品编码', 'size'),
+        件数变化=('本期库存总件数', 'sum'),
+        上期件数=('上期库存总件数', 'sum'),
+        数量变化=('数量变化', 'sum'))
+    by_type['件数变化'] = by_type['件数变化'] - by_type.pop('上期件数')
+    categories = pd.crosstab(changes['上期分类'].astype(object).fillna('无'),
+                             changes['本期分类'].astype(object).fillna('无'))
+    return by_type.reset_index(), categories
+
+
+def delta_to_excel(changes, base_month, month, df2, output=None):
+    """
+    写出变化报表：变化汇总、变化明细、异常类别定义
+    :param changes: compare 的结果
+    :param df2: 异常类别定义
+    :param output: 文件路径或二进制文件对象；为 None 时返回 xlsx 字节串
+    """
+    workbook = Workbook(write_only=True)
+    styles = StyleSet(workbook)
+    by_type, categories = summarize_changes(changes)
+    rows = [[f'变化范围: {base_month} → {month}'], list(by_type.columns)]
+    rows.extend(by_type.astype(object).values.tolist())
+    rows.append([])
+    rows.append(['分类变化（行：上期分类，列：本期分类，值：键数）'])
+    rows.append([''] + list(categories.columns))
+    rows.extend([[index] + values for index, values in zip(categories.index, categories.values.tolist())])
+    summary_sheet = workbook.create_sheet(CHANGE_SUMMARY_SHEET_NAME)
+    for row in rows:
+        summary_sheet.append(row)
+    change_sheet = workbook.create_sheet(CHANGE_SHEET_NAME)
+    column_styles = start_material_sheet(change_sheet, changes, styles)
+    append_material_rows(change_sheet, changes, column_styles, styles)
+    write_description_sheet(workbook.create_sheet(DESCRIPTION_SHEET_NAME), df2, styles)
+
+    target = BytesIO() if output is None else output
+    workbook.save(target)
+    return target.getvalue() if output is None else None
+
@@ -0,0 +1,255 @@
+import pandas as pd
+from copy import copy
+from io import BytesIO
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, NamedStyle, Border, Side
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.formatting.rule import DataBarRule, FormulaRule
+from openpyxl.utils import get_column_letter
+
+from cube import build_cube, summary_tables
+
+# 报表导出：以只写（流式）模式逐行写入工作表，样式通过共享的命名样式设置，不在内存中保留整个工作簿的单元格
+CHUNK_SIZE = 10000
+
+
+# 定义将 RGB 颜色值转换为十六进制颜色代码的函数
+def rgb_to_hex(r, g, b):
+    return '{:02x}{:02x}{:02x}'.format(r, g, b)
+
+
+# 明细表表头颜色（按列序号），其余列使用默认颜色
+HEADER_COLORS = {
+    1: rgb_to_hex(226, 107, 10),
+    2: rgb_to_hex(49, 134, 155),
+    3: rgb_to_hex(226, 107, 10),
+    4: rgb_to_hex(226, 107, 10),
+    5: rgb_to_hex(118, 147, 60),
+    6: rgb_to_hex(118, 147, 60)
+}
+DEFAULT_HEADER_COLOR = "346c9c"
+# 明细表列宽（按列序号），其余列为 16
+COLUMN_WIDTHS = {1: 16, 5: 22, 7: 30}
+DEFAULT_COLUMN_WIDTH = 16
+# 左对齐的列：G列(产品说明)、N列(所在仓库)
+LEFT_ALIGNED_COLUMNS = (7, 14)
+PERCENTAGE_COLUMN = '%(剩余效期/总效期)'
+# datetime64 列按日期格式写入
+DATE_FORMAT = 'yyyy-mm-dd'
+DATA_BAR_COLUMN = 'E'
+# 各明细表的工作表名称（与 to_excel 默认参数一致），顺序同 dataprocess.SHEET_BITS
+MATERIAL_SHEET_NAMES = ['正常品种销售-口腔', '正常品种销售-洗护', '电商', '促销品&非卖', '拓展部', '齿说']
+SUMMARY_SHEET_NAME = '汇总数据'
+DESCRIPTION_SHEET_NAME = '异常类别定义'
+
+
+def _named_styles():
+    center = Alignment(horizontal="center", vertical="center")
+    left = Alignment(horizontal="left", vertical="center")
+    thin = Side(style="thin")
+    styles = [
+        NamedStyle(name="center_style", font=DEFAULT_FONT, alignment=center),
+        NamedStyle(name="left_style", font=DEFAULT_FONT, alignment=left),
+        NamedStyle(name="percentage_style", number_format='0.00%', alignment=center),
+        NamedStyle(name="date_style", font=DEFAULT_FONT, number_format=DATE_FORMAT, alignment=center),
+        NamedStyle(name="title_style", font=Font(bold=True, size=16), alignment=center),
+        NamedStyle(name="text_style", font=Font(size=14, color="000000"), alignment=left),
+        NamedStyle(name="priority_style", font=Font(size=14, color="000000", bold=True), alignment=center),
+    ]
+    for color in sorted(set(HEADER_COLORS.values()) | {DEFAULT_HEADER_COLOR}):
+        styles.append(NamedStyle(
+            name=f"header_{color}",
+            font=Font(bold=True, color="FFFFFF"),
+            fill=PatternFill(start_color=color, end_color=color, fill_type="solid"),
+            alignment=center,
+            border=Border(left=thin, right=thin, top=thin, bottom=thin)))
+    return styles
+
+
+class StyleSet:
+    """
+    工作簿中注册的命名样式；每种样式只生成一次样式数组，单元格共用
+    """
+
+    def __init__(self, workbook):
+        self._arrays = {}
+        for style in _named_styles():
+            workbook.add_named_style(style)
+            self._arrays[style.name] = style.as_tuple()
+
+    def cell(self, worksheet, value, name):
+        cell = WriteOnlyCell(worksheet, value)
+        cell._style = copy(self._arrays[name])
+        return cell
+
+
+def iter_rows(df, chunk_size=CHUNK_SIZE):
+    """
+    按块把 DataFrame 转成 Python 值的行，空值写为空单元格
+    """
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        columns = [col.astype(object).where(col.notna(), None).tolist() for _, col in chunk.items()]
+        yield from zip(*columns)
+
+
+def add_data_bar_rule(worksheet, start_row, end_row, column, color="c00000"):
+    # 范围字符串
+    range_str = f'{column}{start_row}:{column}{end_row}'
+
+    # 添加条件格式规则，清除库存为负数的数据
+    negative_rule = FormulaRule(formula=[f'AND({column}{start_row}<0)'], stopIfTrue=True)
+    worksheet.conditional_formatting.add(range_str, negative_rule)
+
+    # 添加数据条规则
+    data_bar_rule = DataBarRule(
+        start_type='num', start_value=0,
+        end_type='max',
+        color=color
+    )
+    worksheet.conditional_formatting.add(range_str, data_bar_rule)
+
+
+def start_material_sheet(worksheet, df, styles):
+    """
+    明细表写入数据前的准备：设置列宽、写表头
+    :param df: 明细数据（可以只是一部分或空表，用于确定列名和列类型）
+    :return: 数据行各列使用的样式名
+    """
+    n_cols = len(df.columns)
+    # 列宽需在写入数据前设置
+    for idx in range(1, n_cols + 1):
+        worksheet.column_dimensions[get_column_letter(idx)].width = COLUMN_WIDTHS.get(idx, DEFAULT_COLUMN_WIDTH)
+
+    worksheet.append([styles.cell(worksheet, name, f"header_{HEADER_COLORS.get(idx, DEFAULT_HEADER_COLOR)}")
+                      for idx, name in enumerate(df.columns, start=1)])
+    percentage_index = df.columns.get_loc(PERCENTAGE_COLUMN) + 1 if PERCENTAGE_COLUMN in df.columns else None
+    column_styles = []
+    for idx, (_, col) in enumerate(df.items(), start=1):
+        if idx == percentage_index:
+            column_styles.append("percentage_style")
+        elif pd.api.types.is_datetime64_any_dtype(col.dtype):
+            column_styles.append("date_style")
+        elif idx in LEFT_ALIGNED_COLUMNS:
+            column_styles.append("left_style")
+        else:
+            column_styles.append("center_style")
+    return column_styles
+
+
+def append_material_rows(worksheet, df, column_styles, styles):
+    """
+    追加明细数据行，可对同一工作表多次调用
+    """
+    for row in iter_rows(df):
+        worksheet.append([styles.cell(worksheet, value, name) for value, name in zip(row, column_styles)])
+
+
+def finish_material_sheet(worksheet, n_rows):
+    """
+    明细表写完后添加数据条（条件格式在关闭工作表时写入）
+    :param n_rows: 数据行数（含合计行）
+    """
+    add_data_bar_rule(worksheet, start_row=2, end_row=n_rows + 1, column=DATA_BAR_COLUMN)
+
+
+def write_material_sheet(worksheet, df, styles):
+    """
+    写入明细数据表：表头配色、列宽、百分比格式、对齐方式与数据条
+    """
+    column_styles = start_material_sheet(worksheet, df, styles)
+    append_material_rows(worksheet, df, column_styles, styles)
+    finish_material_sheet(worksheet, len(df))
+
+
+def write_description_sheet(worksheet, df2, styles):
+    """
+    写入异常类别定义表
+    """
+    # 设置列宽
+    worksheet.column_dimensions['A'].width = 22
+    worksheet.column_dimensions['B'].width = 108
+    # 设置行高：1~11行行高设置为36
+    height_rows = 11
+    for row in range(1, height_rows + 1):
+        worksheet.row_dimensions[row].height = 36
+    # 合并A1和B1
+    worksheet.merged_cells.add('A1:B1')
+    for row_index, row in enumerate(iter_rows(df2), start=1):
+        cells = []
+        for col_index, value in enumerate(row, start=1):
+            if row_index == 1:
+                name = "title_style"
+            elif col_index == 3 and row_index <= 8:
+                name = "priority_style"
+            else:
+                name = "text_style"
+            cells.append(styles.cell(worksheet, value, name))
+        worksheet.append(cells)
+    # 只写模式下行高随行写出，不足11行时补空行
+    for _ in range(len(df2), height_rows):
+        worksheet.append([])
+
+
+def write_summary_sheet(worksheet, summaries):
+    """
+    写入汇总数据表：每个数据集一块，块之间空一行；先整体生成所有行再逐行追加
+    :param summaries: {数据集: DataFrame(分类, SKU个数, 件数)}，见 cube.summary_tables
+    """
+    rows = []
+    for df_name, result in summaries.items():
+        # 来源描述、列名、数据，空一行分隔不同数据集
+        rows.append([f'数据来源: {df_name}'])
+        rows.append(list(result.columns))
+        rows.extend(result.values.tolist())
+        rows.append([])
+    for row in rows:
+        worksheet.append(row)
+
+
+def write_workbook(output, cube, df2, materials, description_sheet_name=DESCRIPTION_SHEET_NAME):
+    """
+    写出报表：汇总数据、异常类别定义、各明细表
+    :param output: 文件路径或二进制文件对象
+    :param cube: 只按 分类 聚合的汇总立方体
+    :param df2: 异常类别定义
+    :param materials: 各明细表 (工作表名称, 数据块的可迭代对象)，数据块依次追加，最后一块的末行为合计行
+    """
+    workbook = Workbook(write_only=True)
+    styles = StyleSet(workbook)
+    # 工作表顺序：汇总数据、异常类别定义、各明细表
+    write_summary_sheet(workbook.create_sheet(SUMMARY_SHEET_NAME), summary_tables(cube))
+    write_description_sheet(workbook.create_sheet(description_sheet_name), df2, styles)
+    for sheet_name, chunks in materials:
+        worksheet = workbook.create_sheet(sheet_name)
+        column_styles = None
+        n_rows = 0
+        for chunk in chunks:
+            if column_styles is None:
+                column_styles = start_material_sheet(worksheet, chunk, styles)
+            append_material_rows(worksheet, chunk, column_styles, styles)
+            n_rows += len(chunk)
+        finish_material_sheet(worksheet, n_rows)
+    workbook.save(output)
+
+
+# 将 Pandas DataFrame 对象转换为 Excel 文件格式的字节流
+def to_excel(df_s11, df_s12, df_s2, df_s3, df_s4, df_s5, df2,
+            sheet_name1='正常品种销售-口腔', sheet_name2='正常品种销售-洗护', sheet_name3='电商',
+            sheet_name4='促销品&非卖', sheet_name5='拓展部', sheet_name6='齿说', sheet_names='异常类别定义', cube=None):
+    # 汇总数据：由各明细表一次聚合（可传入已计算的立方体）
+    if cube is None:
+        cube = build_cube([df_s11, df_s12, df_s2, df_s3, df_s4, df_s5])
+    material_sheets = [
+        (sheet_name1, [df_s11]),
+        (sheet_name2, [df_s12]),
+        (sheet_name3, [df_s2]),
+        (sheet_name4, [df_s3]),
+        (sheet_name5, [df_s4]),
+        (sheet_name6, [df_s5]),
+    ]
+    output = BytesIO()
+    write_workbook(output, cube, df2, material_sheets, sheet_names)
+    processed_data = output.getvalue()
+    return processed_data
@@ -0,0 +1,325 @@
+import io
+import os
+import tempfile
+import zipfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import xlsxwriter
+except ImportError:  # 未安装时只能使用其他导出格式
+    xlsxwriter = None
+
+from cube import summary_tables
+from excel_export import (HEADER_COLORS, DEFAULT_HEADER_COLOR, COLUMN_WIDTHS, DEFAULT_COLUMN_WIDTH,
+                          LEFT_ALIGNED_COLUMNS, PERCENTAGE_COLUMN, DATE_FORMAT, DATA_BAR_COLUMN,
+                          MATERIAL_SHEET_NAMES, SUMMARY_SHEET_NAME, DESCRIPTION_SHEET_NAME, write_workbook, iter_rows)
+
+# 报表导出格式：带样式的 xlsx（openpyxl 只写模式）、常量内存 xlsx（xlsxwriter）、
+# 以及供下游分析使用的 Parquet / CSV 压缩包（七个工作表各一个文件）
+# 所有格式的输入相同：汇总立方体、异常类别定义、各明细表的数据块（可逐批写入，见 chunked）
+DEFAULT_FORMAT = 'xlsx'
+# Parquet 行组的最少行数：分批处理时的小数据块先合并再写入
+ROW_GROUP_ROWS = 65536
+
+
+class Exporter:
+    """
+    导出格式；子类实现 write(output, cube, df2, materials)
+    - output: 文件路径或二进制文件对象
+    - cube: 只按 分类 聚合的汇总立方体
+    - df2: 异常类别定义
+    - materials: 各明细表 (工作表名称, 数据块的可迭代对象)，最后一块的末行为合计行
+    """
+    label = None
+    suffix = None
+    mime = None
+
+    def write(self, output, cube, df2, materials):
+        raise NotImplementedError
+
+    def export(self, frames, df2, cube, output=None):
+        """
+        导出 filter_special_cases 的结果（各明细表一次写入）
+        :return: output 为 None 时返回字节串
+        """
+        materials = [(name, [df]) for name, df in zip(MATERIAL_SHEET_NAMES, frames)]
+        target = BytesIO() if output is None else output
+        self.write(target, cube, df2, materials)
+        return target.getvalue() if output is None else None
+
+
+class OpenpyxlExporter(Exporter):
+    """
+    带样式的 xlsx（与 excel_export.to_excel 相同）
+    """
+    label = 'Excel（带格式）'
+    suffix = '.xlsx'
+    mime = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    def write(self, output, cube, df2, materials):
+        write_workbook(output, cube, df2, materials)
+
+
+class XlsxWriterExporter(Exporter):
+    """
+    xlsxwriter 常量内存模式：每行写完即写入临时文件，内存占用与行数无关；
+    列宽、表头配色、日期/百分比格式与数据条同 excel_export，数据行的格式按列设置
+    """
+    label = 'Excel（大文件，常量内存）'
+    suffix = '.xlsx'
+    mime = OpenpyxlExporter.mime
+
+    def write(self, output, cube, df2, materials):
+        if xlsxwriter is None:
+            raise ValueError("导出格式 xlsx-fast 需要安装 xlsxwriter")
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'tmpdir': tempfile.gettempdir()})
+        formats = self._formats(workbook)
+        self._write_summary(workbook.add_worksheet(SUMMARY_SHEET_NAME), summary_tables(cube))
+        self._write_description(workbook.add_worksheet(DESCRIPTION_SHEET_NAME), df2, formats)
+        for sheet_name, chunks in materials:
+            self._write_material(workbook.add_worksheet(sheet_name), chunks, formats)
+        workbook.close()
+
+    @staticmethod
+    def _formats(workbook):
+        center = {'align': 'center', 'valign': 'vcenter'}
+        formats = {
+            'center_style': workbook.add_format(center),
+            'left_style': workbook.add_format({'align': 'left', 'valign': 'vcenter'}),
+            'percentage_style': workbook.add_format({**center, 'num_format': '0.00%'}),
+            'date_style': workbook.add_format({**center, 'num_format': DATE_FORMAT}),
+            'title_style': workbook.add_format({**center, 'bold': True, 'font_size': 16}),
+            'text_style': workbook.add_format({'align': 'left', 'valign': 'vcenter', 'font_size': 14}),
+            'priority_style': workbook.add_format({**center, 'bold': True, 'font_size': 14}),
+        }
+        for color in set(HEADER_COLORS.values()) | {DEFAULT_HEADER_COLOR}:
+            formats[f'header_{color}'] = workbook.add_format(
+                {**center, 'bold': True, 'font_color': '#FFFFFF', 'bg_color': f'#{color}', 'border': 1})
+        return formats
+
+    @staticmethod
+    def _write_summary(worksheet, summaries):
+        row = 0
+        for df_name, result in summaries.items():
+            worksheet.write_row(row, 0, [f'数据来源: {df_name}'])
+            worksheet.write_row(row + 1, 0, list(result.columns))
+            for offset, values in enumerate(result.values.tolist(), start=row + 2):
+                worksheet.write_row(offset, 0, values)
+            row += len(result) + 3
+
+    @staticmethod
+    def _write_description(worksheet, df2, formats):
+        worksheet.set_column(0, 0, 22)
+        worksheet.set_column(1, 1, 108)
+        for row_index, row in enumerate(iter_rows(df2)):
+            worksheet.set_row(row_index, 36)
+            if row_index == 0:
+                worksheet.merge_range(0, 0, 0, 1, row[0], formats['title_style'])
+                continue
+            for col_index, value in enumerate(row):
+                name = 'priority_style' if col_index == 2 and row_index < 8 else 'text_style'
+                worksheet.write(row_index, col_index, value, formats[name])
+        # 不足11行时补空行（行高）
+        for row_index in range(len(df2), 11):
+            worksheet.set_row(row_index, 36)
+
+    @staticmethod
+    def _write_material(worksheet, chunks, formats):
+        row_index = 0
+        for chunk in chunks:
+            if row_index == 0:
+                # 数据行使用列格式，单元格不再单独设置格式
+                for idx, (name, col) in enumerate(chunk.items(), start=1):
+                    if name == PERCENTAGE_COLUMN:
+                        column_format = formats['percentage_style']
+                    elif pd.api.types.is_datetime64_any_dtype(col.dtype):
+                        column_format = formats['date_style']
+                    elif idx in LEFT_ALIGNED_COLUMNS:
+                        column_format = formats['left_style']
+                    else:
+                        column_format = formats['center_style']
+                    worksheet.set_column(idx - 1, idx - 1, COLUMN_WIDTHS.get(idx, DEFAULT_COLUMN_WIDTH), column_format)
+                for idx, name in enumerate(chunk.columns, start=1):
+                    worksheet.write(0, idx - 1, name, formats[f"header_{HEADER_COLORS.get(idx, DEFAULT_HEADER_COLOR)}"])
+                row_index = 1
+            for row in iter_rows(chunk):
+                worksheet.write_row(row_index, 0, row)
+                row_index += 1
+        if row_index > 1:
+            cell_range = f'{DATA_BAR_COLUMN}2:{DATA_BAR_COLUMN}{row_index}'
+            worksheet.conditional_format(cell_range, {
+                'type': 'formula', 'criteria': f'=AND({DATA_BAR_COLUMN}2<0)', 'stop_if_true': True})
+            worksheet.conditional_format(cell_range, {
+                'type': 'data_bar', 'bar_color': '#c00000', 'min_type': 'num', 'min_value': 0, 'max_type': 'max'})
+
+
+def _tables(cube, df2, materials):
+    """
+    数据文件的七个表：汇总数据为立方体长表（数据集、分类、SKU个数、件数、数量），
+    明细表不含合计行（分类为空的行），可由明细求和
+    :return: [(表名, 数据块的可迭代对象)]
+    """
+    def details(chunks):
+        for chunk in chunks:
+            yield chunk[chunk['分类'].notna()]
+
+    return ([(SUMMARY_SHEET_NAME, [cube]), (DESCRIPTION_SHEET_NAME, [df2])]
+            + [(name, details(chunks)) for name, chunks in materials])
+
+
+def _integral(values):
+    """
+    数值（可含空值）是否都是整数
+    """
+    values = values[~np.isnan(values)]
+    return bool(np.all(np.mod(values, 1) == 0))
+
+
+def _numbers(col):
+    return pd.to_numeric(col, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _arrow_type(col):
+    """
+    日期为 timestamp；数值列都是整数时为 int64（空值为 null，如 品规、件数在合计行拼接后变成的浮点列），
+    否则为 float64；其他为字符串
+    """
+    if pd.api.types.is_datetime64_any_dtype(col.dtype):
+        return pa.timestamp('ns')
+    if pd.api.types.is_numeric_dtype(col.dtype) and not pd.api.types.is_bool_dtype(col.dtype):
+        if pd.api.types.is_integer_dtype(col.dtype) or _integral(_numbers(col)):
+            return pa.int64()
+        return pa.float64()
+    return pa.string()
+
+
+def _widened(schema, df):
+    """
+    数据块中有小数的 int64 列改为 float64（分批处理时后面的批次才出现零货件数等小数）
+    :return: 新的 schema，不需要改变时返回原 schema
+    """
+    for i, (field, (_, col)) in enumerate(zip(schema, df.items())):
+        if pa.types.is_integer(field.type) and not _integral(_numbers(col)):
+            schema = schema.set(i, pa.field(field.name, pa.float64()))
+    return schema
+
+
+def _arrow_table(df, schema):
+    """
+    按 schema 转换数据块：日期为 timestamp，数值为 int64 或 float64，其他为字符串，同一表的各块类型相同
+    """
+    arrays = []
+    for field, (_, col) in zip(schema, df.items()):
+        if pa.types.is_timestamp(field.type):
+            values = pd.to_datetime(col, errors='coerce').to_numpy(dtype='datetime64[ns]')
+        elif pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            values = _numbers(col)
+        else:
+            values = col.astype(object)
+            values = values.where(values.isna(), values.astype(str)).to_numpy()
+        arrays.append(pa.array(values, type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class ParquetExporter(Exporter):
+    """
+    Parquet 压缩包：每个表一个 .parquet 文件，明细表逐块写入同一文件的多个行组；
+    整数列保存为 int64，后面的数据块出现小数时把已写入的部分改为 float64 重写
+    """
+    label = 'Parquet（压缩包）'
+    suffix = '.zip'
+    mime = 'application/zip'
+
+    def write(self, output, cube, df2, materials):
+        with tempfile.TemporaryDirectory() as tmp, zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+            for name, chunks in _tables(cube, df2, materials):
+                path = os.path.join(tmp, f'{name}.parquet')
+                writer = None
+                empty = None
+                pending = []
+                for chunk in chunks:
+                    if not len(chunk):
+                        empty = chunk if empty is None else empty
+                        continue
+                    if writer is None:
+                        # 列类型由第一个非空数据块确定（分批处理时个别批次的列可能全为空）
+                        schema = pa.schema([(str(col), _arrow_type(chunk[col])) for col in chunk.columns])
+                        writer = pq.ParquetWriter(path, schema)
+                    schema = _widened(writer.schema, chunk)
+                    if not schema.equals(writer.schema):
+                        writer = _rewrite(writer, path, schema)
+                        pending = [table.cast(schema) for table in pending]
+                    pending.append(_arrow_table(chunk, writer.schema))
+                    if sum(len(table) for table in pending) >= ROW_GROUP_ROWS:
+                        writer.write_table(pa.concat_tables(pending))
+                        pending = []
+                if pending:
+                    writer.write_table(pa.concat_tables(pending))
+                if writer is None and empty is not None:
+                    # 没有数据时只写列名
+                    schema = pa.schema([(str(col), _arrow_type(empty[col])) for col in empty.columns])
+                    writer = pq.ParquetWriter(path, schema)
+                if writer is not None:
+                    writer.close()
+                    archive.write(path, f'{name}.parquet')
+
+
+def _rewrite(writer, path, schema):
+    """
+    关闭写入器，已写入的数据按新的 schema 重写到同一文件，返回新的写入器
+    """
+    writer.close()
+    written = pq.read_table(path).cast(schema)
+    writer = pq.ParquetWriter(path, schema)
+    if len(written):
+        writer.write_table(written)
+    return writer
+
+
+class CsvExporter(Exporter):
+    """
+    CSV 压缩包：每个表一个 UTF-8（带 BOM，Excel 可直接打开）的 .csv 文件，逐块追加
+    """
+    label = 'CSV（压缩包）'
+    suffix = '.zip'
+    mime = 'application/zip'
+
+    def write(self, output, cube, df2, materials):
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, chunks in _tables(cube, df2, materials):
+                with archive.open(f'{name}.csv', 'w') as f, io.TextIOWrapper(
+                        f, encoding='utf-8-sig', newline='') as text:
+                    header = True
+                    for chunk in chunks:
+                        chunk.to_csv(text, index=False, header=header, date_format='%Y-%m-%d')
+                        header = False
+
+
+EXPORTERS = {
+    'xlsx': OpenpyxlExporter(),
+    'xlsx-fast': XlsxWriterExporter(),
+    'parquet': ParquetExporter(),
+    'csv': CsvExporter(),
+}
+
+
+def get_exporter(export_format):
+    """
+    :param export_format: EXPORTERS 中的名称
+    """
+    try:
+        return EXPORTERS[export_format]
+    except KeyError:
+        raise ValueError(f"不支持的导出格式：{export_format}，可选：{list(EXPORTERS)}") from None
+
+
+def export(export_format, frames, df2, cube, output=None):
+    """
+    按指定格式导出各明细表，见 Exporter.export
+    """
+    return get_exporter(export_format).export(frames, df2, cube, output)
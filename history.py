@@ -0,0 +1,250 @@
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import dataprocess as dp
+from datadir import data_directory
+from keyindex import normalized_column
+
+# 历史明细存储：每次处理的 sort_and_filter 明细按 月份/仓库分类 分区写入 Parquet，
+# 另存 产品编码/批次号 → 分区 的索引，按 SKU/批次查询时只读取包含它的分区和需要的列
+DEFAULT_DIRECTORY = data_directory('history')
+DATA_DIR = 'detail'
+INDEX_DIR = 'index'
+MONTH_COLUMN = '月份'
+AS_OF_COLUMN = '月末日期'
+PARTITION_COLUMNS = [MONTH_COLUMN, '仓库分类']
+KEY_COLUMNS = ['产品编码', '批次号', '所在仓库']
+# 各月数据按固定类型写入，查询时各分区的列类型一致
+SCHEMA = pa.schema([
+    ('分类', pa.string()),
+    ('处理方案', pa.string()),
+    ('效期类别', pa.string()),
+    ('180天无动销', pa.string()),
+    ('%(剩余效期/总效期)', pa.float64()),
+    ('剩余效期天数', pa.float64()),
+    ('产品说明', pa.string()),
+    ('品规', pa.float64()),
+    ('库存总件数', pa.float64()),
+    ('数量', pa.float64()),
+    ('产品编码', pa.string()),
+    ('批次号', pa.string()),
+    ('失效日期', pa.timestamp('ns')),
+    ('所在仓库', pa.string()),
+    (dp.SOURCE_COLUMN, pa.string()),
+    (AS_OF_COLUMN, pa.timestamp('ns')),
+    (MONTH_COLUMN, pa.string()),
+    ('仓库分类', pa.string()),
+])
+INDEX_SCHEMA = pa.schema([
+    ('产品编码', pa.string()),
+    ('批次号', pa.string()),
+    (MONTH_COLUMN, pa.string()),
+    ('仓库分类', pa.string()),
+])
+PARTITIONING = ds.partitioning(pa.schema([(MONTH_COLUMN, pa.string())]), flavor='hive')
+DATA_PARTITIONING = ds.partitioning(pa.schema([(col, pa.string()) for col in PARTITION_COLUMNS]), flavor='hive')
+
+
+def month_of(as_of):
+    """
+    月末日期 → 分区用的月份，如 '2024-12'
+    """
+    return pd.Timestamp(as_of).strftime('%Y-%m')
+
+
+def _to_table(detail, as_of):
+    df = pd.DataFrame(index=pd.RangeIndex(len(detail)))
+    for field in SCHEMA:
+        name = field.name
+        if name == AS_OF_COLUMN:
+            df[name] = pd.Timestamp(as_of)
+        elif name == MONTH_COLUMN:
+            df[name] = month_of(as_of)
+        elif name not in detail.columns:
+            df[name] = None
+        elif pa.types.is_timestamp(field.type):
+            df[name] = pd.to_datetime(detail[name].to_numpy(), errors='coerce')
+        elif pa.types.is_floating(field.type):
+            df[name] = pd.to_numeric(detail[name].to_numpy(), errors='coerce').astype('float64')
+        else:
+            # 文本列统一为去空格的字符串（与 merge_and_mark 的关键字段格式相同），数字编码也按字符串保存
+            df[name] = np.asarray(normalized_column(detail, name), dtype=object)
+    return pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False)
+
+
+class HistoryStore:
+    """
+    历史明细存储
+    用法：
+        history = HistoryStore(directory)
+        history.append(df_res, '2024-12-31')          # df_res 为 sort_and_filter 的结果，同一月份重复写入时覆盖
+        history.series(产品编码='690100000001')        # 某个 SKU 各月的明细
+        history.transitions('2024-11', '2024-12')     # 两个月之间分类的变化
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.data_dir = os.path.join(directory, DATA_DIR)
+        self.index_dir = os.path.join(directory, INDEX_DIR)
+
+    def _month_dirs(self, month):
+        return [os.path.join(root, f'{MONTH_COLUMN}={month}') for root in (self.data_dir, self.index_dir)]
+
+    def append(self, detail, as_of, replace=True):
+        """
+        写入一个月的明细
+        :param detail: sort_and_filter 的结果（或分批处理时的一批明细）
+        :param as_of: 月末日期
+        :param replace: 为 True 时先删除该月已有的数据；分批写入同一月份时第一批之后传 False
+        :return: 写入的行数
+        """
+        month = month_of(as_of)
+        if replace:
+            for path in self._month_dirs(month):
+                shutil.rmtree(path, ignore_errors=True)
+        # 按 SKU/批次排序写入，文件内的行组统计信息可用于按编码过滤
+        table = _to_table(detail, as_of).sort_by([('产品编码', 'ascending'), ('批次号', 'ascending')])
+        part = uuid.uuid4().hex
+        ds.write_dataset(table, self.data_dir, format='parquet', partitioning=DATA_PARTITIONING,
+                         basename_template=f'part-{part}-{{i}}.parquet', existing_data_behavior='overwrite_or_ignore')
+        index = table.select([field.name for field in INDEX_SCHEMA]).group_by(
+            [field.name for field in INDEX_SCHEMA]).aggregate([])
+        ds.write_dataset(index.select([field.name for field in INDEX_SCHEMA]), self.index_dir, format='parquet',
+                         partitioning=PARTITIONING, basename_template=f'part-{part}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore')
+        return len(table)
+
+    def months(self):
+        """
+        已保存的月份（升序）
+        """
+        if not os.path.isdir(self.data_dir):
+            return []
+        prefix = f'{MONTH_COLUMN}='
+        return sorted(name[len(prefix):] for name in os.listdir(self.data_dir) if name.startswith(prefix))
+
+    def month_version(self, month):
+        """
+        某个月份数据的最后写入时间，没有该月份时返回 None；用于判断依赖该月份的结果是否需要重新生成
+        """
+        times = [os.path.getmtime(os.path.join(root, name))
+                 for root, _, names in os.walk(self._month_dirs(month)[0]) for name in names]
+        return max(times) if times else None
+
+    def _dataset(self, root, partitioning):
+        return ds.dataset(root, format='parquet', partitioning=partitioning)
+
+    def _partitions(self, 产品编码=None, 批次号=None):
+        """
+        从索引中查找包含指定 SKU/批次的 (月份, 仓库分类)
+        """
+        if not os.path.isdir(self.index_dir):
+            return []
+        condition = _key_filter(产品编码, 批次号)
+        index = self._dataset(self.index_dir, PARTITIONING).to_table(
+            columns=[MONTH_COLUMN, '仓库分类'], filter=condition)
+        return index.group_by([MONTH_COLUMN, '仓库分类']).aggregate([]).to_pylist()
+
+    def read(self, columns=None, months=None, filter=None):
+        """
+        读取历史明细
+        :param columns: 需要的列，默认全部
+        :param months: 月份列表，默认全部
+        :param filter: 附加的 pyarrow 过滤条件
+        """
+        if not os.path.isdir(self.data_dir):
+            return pd.DataFrame(columns=columns or SCHEMA.names)
+        condition = filter
+        if months is not None:
+            month_filter = ds.field(MONTH_COLUMN).isin(list(months))
+            condition = month_filter if condition is None else condition & month_filter
+        table = self._dataset(self.data_dir, DATA_PARTITIONING).to_table(columns=columns, filter=condition)
+        return _to_frame(table)
+
+    def series(self, 产品编码=None, 批次号=None, columns=None):
+        """
+        SKU 或批次各月的明细，按月份排序；只读取索引中包含它的分区
+        :param columns: 需要的列，默认为 月份、关键字段、分类、效期类别、剩余效期天数、库存总件数、数量
+        """
+        if 产品编码 is None and 批次号 is None:
+            raise ValueError("需要指定产品编码或批次号")
+        columns = columns or [MONTH_COLUMN, '产品编码', '批次号', '所在仓库', '仓库分类', '分类', '效期类别',
+                              '剩余效期天数', '库存总件数', '数量']
+        partitions = self._partitions(产品编码, 批次号)
+        if not partitions:
+            return pd.DataFrame(columns=columns)
+        partition_filter = None
+        for item in partitions:
+            condition = (ds.field(MONTH_COLUMN) == item[MONTH_COLUMN]) & (ds.field('仓库分类') == item['仓库分类'])
+            partition_filter = condition if partition_filter is None else partition_filter | condition
+        df = self.read(columns=columns, filter=partition_filter & _key_filter(产品编码, 批次号))
+        return df.sort_values([MONTH_COLUMN] + [col for col in KEY_COLUMNS if col in df.columns],
+                              ignore_index=True)
+
+    def snapshot(self, month, columns=('仓库分类', '分类', '数量')):
+        """
+        某个月份每个 (产品编码, 批次号, 所在仓库) 一行，见 by_key；只读取该月份的关键字段和指定列
+        """
+        df = self.read(columns=KEY_COLUMNS + list(columns), months=[month])
+        return by_key(df)
+
+    def previous_month(self, month):
+        """
+        早于 month 的最近一个已保存月份，没有时返回 None
+        """
+        earlier = [item for item in self.months() if item < month]
+        return earlier[-1] if earlier else None
+
+    def transitions(self, from_month, to_month):
+        """
+        两个月之间每个 (产品编码, 批次号, 所在仓库) 的分类变化；只读取两个月份的关键字段和分类
+        :return: (明细, 分类变化计数表)；明细中只出现在一个月份的键，另一个月份的分类为空
+        """
+        before, after = self.snapshot(from_month), self.snapshot(to_month)
+        detail = before.merge(after, on=KEY_COLUMNS, how='outer', suffixes=(f'_{from_month}', f'_{to_month}'))
+        counts = pd.crosstab(detail[f'分类_{from_month}'].astype(object).fillna('无'),
+                             detail[f'分类_{to_month}'].astype(object).fillna('无'))
+        return detail, counts
+
+
+def _key_filter(产品编码=None, 批次号=None):
+    condition = None
+    for col, value in (('产品编码', 产品编码), ('批次号', 批次号)):
+        if value is not None:
+            values = [value] if isinstance(value, str) else list(value)
+            expression = ds.field(col).isin([str(item).strip() for item in values])
+            condition = expression if condition is None else condition & expression
+    return condition
+
+
+def by_key(df):
+    """
+    同一键在一个月内可能有多行（如不同失效日期）：分类取优先级最高的，件数、数量相加，其他列取第一行
+    """
+    df = df.copy()
+    for col in KEY_COLUMNS:
+        df[col] = df[col].astype(object)
+    if '分类' in df.columns:
+        df['分类'] = pd.Categorical(df['分类'].astype(object), categories=dp.CATEGORY_ORDER, ordered=True)
+    aggregations = {col: 'min' if col == '分类' else 'sum' if col in ('库存总件数', '数量') else 'first'
+                    for col in df.columns if col not in KEY_COLUMNS}
+    return df.groupby(KEY_COLUMNS, dropna=False).agg(aggregations).reset_index()
+
+
+def _to_frame(table):
+    """
+    读取结果转为 DataFrame：关键字段为分类类型，分类为有序分类
+    """
+    df = table.to_pandas()
+    for col in KEY_COLUMNS + ['仓库分类', MONTH_COLUMN]:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    if '分类' in df.columns:
+        df['分类'] = pd.Categorical(df['分类'], categories=dp.CATEGORY_ORDER, ordered=True)
+    return df
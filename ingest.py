@@ -0,0 +1,196 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+from operator import itemgetter
+from openpyxl import load_workbook
+from pandas.api.types import union_categoricals
+
+from dataprocess import SOURCE_COLUMN
+
+# 上传文件的列式读取：只取 dataprocess.read_data 用到的列，并在读取时确定列类型
+INVENTORY_COLUMNS = ['产品说明', '产品编码', '品规', '库存总件数(销售可用+零货+破损+冻结)', '批次', '失效日期', '生产日期', '所在仓库']
+STALE_COLUMNS = ['产品编码', '批次号', '所在仓库']
+# 出入库流水（可选输入，用于计算最后动销日期，见 movement）
+LEDGER_COLUMNS = ['产品编码', '批次号', '所在仓库', '业务日期']
+# 列类型声明
+CATEGORY_COLUMNS = ['所在仓库', '产品编码', '批次', '批次号']
+NUMERIC_COLUMNS = ['品规', '库存总件数(销售可用+零货+破损+冻结)']
+# 日期列及解析出错时的处理方式（与 read_data 保持一致）
+DATE_COLUMNS = {'生产日期': 'raise', '失效日期': 'coerce', '业务日期': 'coerce'}
+
+
+def iter_columns(file, columns, batch_size=None):
+    """
+    以只读流式方式读取 Excel 第一个工作表中的指定列，按批返回
+    :param file: 文件路径或文件对象（如 st.file_uploader 的返回值）
+    :param columns: 需要读取的列名（按表头匹配）
+    :param batch_size: 每批行数，None 表示一次返回全部
+    :return: 逐批生成只包含指定列的 DataFrame，列类型按声明转换
+    """
+    workbook = load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        worksheet = workbook.worksheets[0]
+        header = next(worksheet.iter_rows(max_row=1, values_only=True), ())
+        header = [str(name).strip() if name is not None else None for name in header]
+        missing_cols = [col for col in columns if col not in header]
+        if missing_cols:
+            raise ValueError(f"文件缺少字段：{missing_cols}")
+        # 重复表头取第一次出现的列
+        indexes = [header.index(col) for col in columns]
+        width = max(indexes) + 1
+        # 最后一个所需列之后的单元格不再读取
+        rows = worksheet.iter_rows(min_row=2, max_col=width, values_only=True)
+        pick = itemgetter(*indexes)
+        records = []
+        n_batches = 0
+        for row in rows:
+            # 只读模式下行尾的空单元格可能被省略
+            if len(row) < width:
+                row = row + (None,) * (width - len(row))
+            values = pick(row)
+            if len(indexes) == 1:
+                values = (values,)
+            # 跳过所需列全为空的行
+            if any(value is not None for value in values):
+                records.append(values)
+            if batch_size is not None and len(records) >= batch_size:
+                yield _to_frame(records, columns)
+                n_batches += 1
+                records = []
+        if records or n_batches == 0:
+            yield _to_frame(records, columns)
+    finally:
+        workbook.close()
+
+
+def read_columns(file, columns):
+    """
+    读取指定列的全部数据
+    """
+    return next(iter_columns(file, columns))
+
+
+def _to_frame(records, columns):
+    data = list(zip(*records)) if records else [()] * len(columns)
+    return pd.DataFrame({col: _convert_column(col, values) for col, values in zip(columns, data)},
+                        columns=columns)
+
+
+def _convert_column(col, values):
+    if col in DATE_COLUMNS:
+        return pd.to_datetime(pd.Series(values, dtype=object), errors=DATE_COLUMNS[col])
+    if col in CATEGORY_COLUMNS:
+        return pd.Categorical(values)
+    if col in NUMERIC_COLUMNS:
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce')
+    return np.array(values, dtype=object)
+
+
+def read_inventory(file):
+    # 库存信息
+    return read_columns(file, INVENTORY_COLUMNS)
+
+
+def iter_inventory(file, batch_size):
+    # 库存信息，按批读取
+    return iter_columns(file, INVENTORY_COLUMNS, batch_size)
+
+
+def read_stale(file):
+    # 呆滞数据文件
+    return read_columns(file, STALE_COLUMNS)
+
+
+def read_ledger(file):
+    # 出入库流水
+    return read_columns(file, LEDGER_COLUMNS)
+
+
+def source_name(file):
+    """
+    来源文件名：路径取文件名，(文件名, 内容) 取文件名，上传对象取 name 属性
+    """
+    if isinstance(file, tuple):
+        return file[0]
+    if isinstance(file, (str, os.PathLike)):
+        return os.path.basename(file)
+    return getattr(file, 'name', None)
+
+
+def as_file(file):
+    # (文件名, 字节串) 转为文件对象，其他原样返回
+    return BytesIO(file[1]) if isinstance(file, tuple) else file
+
+
+def read_source(file, reader):
+    """
+    读取一个文件并加上来源文件列，可在子进程中运行
+    :param file: 文件路径或 (文件名, 字节串)
+    :param reader: 读取函数，如 read_inventory
+    """
+    name = source_name(file)
+    try:
+        df = reader(as_file(file))
+    except ValueError as e:
+        raise ValueError(f"{name}：{e}") from e
+    df[SOURCE_COLUMN] = pd.Categorical([name] * len(df))
+    return df
+
+
+def concat_frames(frames):
+    """
+    按列名对齐拼接多个文件的读取结果；各文件都是分类类型的列合并类别后保持分类类型
+    """
+    frames = list(frames)
+    columns = list(dict.fromkeys(col for df in frames for col in df.columns))
+    data = {}
+    for col in columns:
+        parts = [df[col] if col in df.columns else pd.Series([None] * len(df), dtype=object) for df in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            data[col] = union_categoricals(parts)
+        else:
+            data[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(data, columns=columns)
+
+
+def read_files(files, reader, max_workers=None):
+    """
+    多个文件在进程池中并行读取，每个文件的结果带来源文件列
+    :param files: 文件路径或 (文件名, 字节串) 的列表
+    :param reader: 读取函数，如 read_inventory
+    :param max_workers: 进程数，默认为文件数与 CPU 核数的较小值；为 1 时在当前进程中依次读取
+                        （在后台任务的子进程中调用时应限制，见 jobs.JobRunner 的 read_workers）
+    :return: 各文件的 DataFrame，顺序与 files 相同
+    """
+    files = list(files)
+    max_workers = min(len(files), max_workers or os.cpu_count() or 1)
+    if max_workers <= 1:
+        return [read_source(file, reader) for file in files]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(read_source, files, repeat(reader)))
+
+
+def read_many(files, reader, max_workers=None):
+    """
+    读取一个或多个文件；只有一个文件时不加来源文件列，与单文件读取结果相同
+    """
+    files = list(files)
+    if len(files) == 1:
+        return reader(as_file(files[0]))
+    return concat_frames(read_files(files, reader, max_workers))
+
+
+def iter_many(files, batch_size):
+    """
+    按批依次读取多个库存数据文件，多个文件时每批带来源文件列
+    """
+    files = list(files)
+    for file in files:
+        for df in iter_inventory(as_file(file), batch_size):
+            if len(files) > 1:
+                df[SOURCE_COLUMN] = pd.Categorical([source_name(file)] * len(df))
+            yield df
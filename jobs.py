@@ -0,0 +1,306 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import ingest
+from history import HistoryStore, DEFAULT_DIRECTORY as HISTORY_DIRECTORY, month_of
+from movement import MovementIndex, DEFAULT_DIRECTORY as MOVEMENT_DIRECTORY, index_version, stale_keys, update_index
+from exporters import DEFAULT_FORMAT, get_exporter
+from chunked import build_report_chunked
+from pipeline import build_outputs
+from profiling import StageProfiler, PIPELINE_STAGES
+from upload_cache import (read_cached_many, DiskFrameCache, DEFAULT_DIRECTORY as CACHE_DIRECTORY,
+                          DEFAULT_DISK_MAX_BYTES as CACHE_MAX_BYTES)
+
+# 后台任务：在有上限的进程池中处理上传文件，页面提交后拿到任务号并轮询进度与结果，
+# 内容相同（文件、日期、仓库映射、分析选项都相同）的提交合并为同一个任务
+# 按批处理时每批依次为 process_batch、spool_batch、append_history，排在 append_history 之前
+JOB_STAGES = (['read_inventory', 'read_stale', 'update_movements']
+              + PIPELINE_STAGES[:PIPELINE_STAGES.index('append_history')] + ['process_batch', 'spool_batch']
+              + PIPELINE_STAGES[PIPELINE_STAGES.index('append_history'):])
+DEFAULT_MAX_WORKERS = max(1, min(4, os.cpu_count() or 1))
+# 保留结果的已结束任务数
+DEFAULT_MAX_FINISHED = 16
+# 每个任务并行解析多个上传文件的进程数：任务本身已在进程池中运行，默认在任务进程中依次解析，
+# 避免每个任务再按 CPU 核数启动进程池（同时处理的任务数 × 核数个进程）
+DEFAULT_READ_WORKERS = 1
+
+PENDING = '排队中'
+RUNNING = '处理中'
+DONE = '已完成'
+FAILED = '失败'
+
+
+def as_files(files):
+    """
+    上传内容统一为 (文件名, 字节串) 的列表；单个字节串视为一个无名文件
+    """
+    if files is None:
+        return []
+    if isinstance(files, bytes):
+        return [(None, files)]
+    return [(name, data) for name, data in files]
+
+
+def job_key(inventory, stale, date_value, cp_warehouses, **options):
+    """
+    任务号：输入内容的 SHA-256
+    :param inventory: 库存数据文件，(文件名, 字节串) 的列表
+    :param stale: 呆滞数据文件，(文件名, 字节串) 的列表
+    :param options: 其他影响结果的选项，如 profile_stage、出入库流水及动销索引版本
+    """
+    digest = hashlib.sha256()
+    ledger = options.pop('ledger', [])
+    for files in (inventory, stale, ledger):
+        # 多个文件时文件名会写入来源文件列，也计入任务号
+        digest.update(json.dumps([name for name, _ in files] if len(files) > 1 else [], ensure_ascii=False).encode())
+        for _, data in files:
+            digest.update(hashlib.sha256(data).digest())
+    digest.update(str(date_value).encode())
+    digest.update(json.dumps(dict(cp_warehouses), sort_keys=True, ensure_ascii=False).encode())
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def run_report(job_id, inventory, stale, date_value, cp_warehouses, profile_stage=None, trace_stage=None,
+               progress=None, store=None, ledger=None, use_movements=False, movement_dir=MOVEMENT_DIRECTORY,
+               history_dir=None, delta=False, export_format=DEFAULT_FORMAT, cache=None,
+               read_workers=DEFAULT_READ_WORKERS, batch_size=None):
+    """
+    在子进程中处理一个任务
+    :param inventory: 库存数据文件，(文件名, 字节串) 的列表
+    :param stale: 呆滞数据文件，(文件名, 字节串) 的列表，使用出入库流水时可为空
+    :param progress: 进度队列，每个步骤开始时放入 (任务号, 步骤名)
+    :param store: ResultStore，指定时报表写入磁盘，结果中只返回文件路径
+    :param ledger: 出入库流水文件，(文件名, 字节串) 的列表，上传后并入动销索引
+    :param use_movements: 是否由动销索引得到无动销清单（上传了流水时总是使用）
+    :param movement_dir: 动销索引目录
+    :param history_dir: 历史数据目录，指定时该月的明细写入历史数据
+    :param delta: 只导出与历史数据中上一个月份相比的变化，需要 history_dir
+    :param export_format: 导出格式，见 exporters.EXPORTERS（变化报表总是 xlsx）
+    :param cache: 上传文件解析结果的缓存，默认为子进程内的 upload_cache.frame_cache
+    :param read_workers: 并行解析多个上传文件的进程数
+    :param batch_size: 指定时按批读取和处理库存数据（见 chunked），内存占用与库存总行数无关；库存文件不使用解析缓存
+    :return: {'excel_file': 报表字节串（或 'excel_path': 报表文件路径）, 'cube': 汇总立方体（按批处理的变化报表为 None）,
+              'records': 各步骤耗时记录, 'delta': 是否为变化报表, 'export_format': 导出格式, 'history_version': 写入后该月历史数据的版本}
+    """
+    on_stage = (lambda stage: progress.put((job_id, stage))) if progress is not None else None
+    profiler = StageProfiler(profile_stage=profile_stage, trace_stage=trace_stage, on_stage=on_stage)
+    # 按文件内容缓存解析结果，同一文件换日期重算时不再解析；多个文件并行解析后合并（按批处理时库存数据在生成报表时逐批读取）
+    df1 = None if batch_size else profiler.run('read_inventory', read_cached_many, inventory, ingest.read_inventory,
+                                               cache, read_workers)
+    df2 = profiler.run('read_stale', read_cached_many, stale, ingest.read_stale, cache,
+                       read_workers) if stale else None
+    index = None
+    if ledger or use_movements:
+        index = profiler.run('update_movements', _update_movements, ledger, movement_dir, cache, read_workers)
+    df2 = stale_keys(date_value, df2, index)
+    history = HistoryStore(history_dir) if history_dir else None
+    if batch_size:
+        excel_file, cube = build_report_chunked(ingest.iter_many(inventory, batch_size), df2, date_value, cp_warehouses,
+                                                profiler=profiler, history=history, delta=delta,
+                                                export_format=export_format)
+    else:
+        excel_file, cube = build_outputs(df1, df2, date_value, cp_warehouses, profiler, history=history, delta=delta,
+                                         export_format=export_format)
+    meta = {'cube': cube, 'records': profiler.records, 'delta': delta,
+            'export_format': DEFAULT_FORMAT if delta else export_format,
+            'history_version': history.month_version(month_of(date_value)) if history is not None else None}
+    if store is not None:
+        # 报表按导出格式的后缀保存（parquet/csv 为 .zip），格式记录在附带信息中
+        return {'excel_path': store.put(job_id, excel_file, meta, get_exporter(meta['export_format']).suffix), **meta}
+    return {'excel_file': excel_file, **meta}
+
+
+def _update_movements(ledger, directory, cache=None, read_workers=DEFAULT_READ_WORKERS):
+    # 读取已保存的动销索引；有新上传的流水时在更新锁内重新读取、并入并保存，同时上传的流水不会互相覆盖
+    if ledger:
+        return update_index(read_cached_many(ledger, ingest.read_ledger, cache, read_workers), directory)
+    return MovementIndex.load(directory)
+
+
+class Job:
+    """
+    任务状态，由 JobRunner 在主进程中更新
+    """
+
+    def __init__(self, job_id, date_value):
+        self.job_id = job_id
+        self.date_value = date_value
+        self.status = PENDING
+        self.stage = None
+        self.error = None
+        self.result = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    @property
+    def progress(self):
+        """
+        已开始的步骤占全部步骤的比例（0~1）
+        """
+        if self.status == DONE:
+            return 1.0
+        if self.stage not in JOB_STAGES:
+            return 0.0
+        return JOB_STAGES.index(self.stage) / len(JOB_STAGES)
+
+
+class JobRunner:
+    """
+    后台任务执行器，所有会话共用
+    用法：
+        runner = JobRunner(max_workers=4)
+        job_id = runner.submit([(name, data), ...], [(name, data), ...], date_value, cp_warehouses)
+        job = runner.get(job_id)     # job.status / job.stage / job.progress / job.result
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_finished=DEFAULT_MAX_FINISHED, store=None,
+                 movement_dir=MOVEMENT_DIRECTORY, history_dir=HISTORY_DIRECTORY, cache_dir=CACHE_DIRECTORY,
+                 cache_max_bytes=CACHE_MAX_BYTES, read_workers=DEFAULT_READ_WORKERS, batch_size=None):
+        """
+        :param max_workers: 进程池大小，同时处理的任务数上限
+        :param max_finished: 保留结果的已结束任务数，超出时丢弃最早结束的任务
+        :param store: ResultStore，指定时报表保存在磁盘上，已有结果的提交直接完成
+        :param movement_dir: 动销索引目录
+        :param history_dir: 历史数据目录
+        :param cache_dir: 上传文件解析结果的磁盘缓存目录，各子进程共用（同一文件换日期重新提交时，
+                          无论落在哪个子进程上都不再解析）
+        :param cache_max_bytes: 磁盘缓存的容量上限（字节）
+        :param read_workers: 每个任务并行解析多个上传文件的进程数，同时最多有 max_workers × read_workers 个解析进程
+        :param batch_size: 指定时库存数据按批读取和处理（见 chunked），库存文件很大时任务的内存占用与行数无关
+        """
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self.store = store
+        self.movement_dir = movement_dir
+        self.history_dir = history_dir
+        self.cache = DiskFrameCache(cache_dir, cache_max_bytes)
+        self.read_workers = read_workers
+        self.batch_size = batch_size
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._manager = None
+        self._progress = None
+
+    def _start(self):
+        # 进程池和进度队列在第一次提交时才创建；使用 spawn，避免在多线程的 Streamlit 进程中 fork
+        if self._executor is None:
+            context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            self._manager = context.Manager()
+            self._progress = self._manager.Queue()
+            threading.Thread(target=self._watch_progress, daemon=True).start()
+
+    def _watch_progress(self):
+        while True:
+            try:
+                job_id, stage = self._progress.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None and not job.finished:
+                    job.status = RUNNING
+                    job.stage = stage
+
+    def submit(self, inventory, stale, date_value, cp_warehouses, profile_stage=None, trace_stage=None,
+               ledger=None, use_movements=False, save_history=False, delta=False, export_format=DEFAULT_FORMAT):
+        """
+        提交任务；相同输入的任务未失败（且结果仍在存储中）时直接返回已有任务号，
+        存储中已有结果时任务直接完成；写入历史数据的任务还要求该月的历史数据未被改写
+        :param inventory: 库存数据文件，(文件名, 字节串) 的列表或单个字节串
+        :param stale: 呆滞数据文件，(文件名, 字节串) 的列表或单个字节串，使用出入库流水时可为空
+        :param ledger: 出入库流水文件，(文件名, 字节串) 的列表
+        :param use_movements: 由已保存的动销索引得到无动销清单
+        :param save_history: 明细写入历史数据（同一月份再次写入时覆盖）
+        :param delta: 只导出与历史数据中上一个月份相比的变化（总是写入历史数据）
+        :param export_format: 导出格式，见 exporters.EXPORTERS
+        :return: 任务号
+        """
+        inventory, stale, ledger = as_files(inventory), as_files(stale), as_files(ledger)
+        use_movements = bool(use_movements or ledger)
+        cp_warehouses = dict(cp_warehouses)
+        history_dir = self.history_dir if save_history or delta else None
+        base = None
+        if delta:
+            # 变化报表还取决于上一个月份的历史数据
+            history = HistoryStore(history_dir)
+            base_month = history.previous_month(month_of(date_value))
+            base = (base_month, history.month_version(base_month) if base_month else None)
+        # 使用动销索引时结果还取决于索引当前的内容
+        job_id = job_key(inventory, stale, date_value, cp_warehouses,
+                         profile_stage=profile_stage, trace_stage=trace_stage, ledger=ledger,
+                         movements=index_version(self.movement_dir) if use_movements else None,
+                         history=history_dir, delta=base, export_format=export_format, batch_size=self.batch_size)
+        # 写入历史数据的任务：该月的历史数据仍是已有结果写入的那一版时才直接使用已有结果，
+        # 否则（被其他任务覆盖、被删除）重新处理并写入
+        written = HistoryStore(history_dir).month_version(month_of(date_value)) if history_dir else None
+        stored = self.store.get(job_id) if self.store is not None else None
+        if stored is not None and stored[1].get('history_version') != written:
+            stored = None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and (job.status in (PENDING, RUNNING) or job.status == DONE and (
+                    self.store is None and job.result.get('history_version') == written or stored is not None)):
+                return job_id
+            job = Job(job_id, date_value)
+            self._jobs[job_id] = job
+            if stored is not None:
+                path, meta = stored
+                job.result = {'excel_path': path, **meta}
+                job.status = DONE
+                job.finished_at = time.time()
+                return job_id
+            self._start()
+            future = self._executor.submit(run_report, job_id, inventory, stale, date_value, cp_warehouses,
+                                           profile_stage, trace_stage, self._progress, self.store,
+                                           ledger, use_movements, self.movement_dir, history_dir, delta,
+                                           export_format, self.cache, self.read_workers, self.batch_size)
+        future.add_done_callback(lambda f: self._finish(job, f))
+        return job_id
+
+    def _finish(self, job, future):
+        with self._lock:
+            job.finished_at = time.time()
+            try:
+                job.result = future.result()
+            except Exception as e:
+                job.status = FAILED
+                job.error = f"{type(e).__name__}: {e}"
+            else:
+                job.status = DONE
+                job.stage = None
+            # 超出保留数量时丢弃最早结束的任务
+            finished = [key for key, item in self._jobs.items() if item.finished]
+            for key in sorted(finished, key=lambda key: self._jobs[key].finished_at)[:-self.max_finished]:
+                del self._jobs[key]
+        if self.store is not None:
+            self.store.evict()
+
+    def get(self, job_id):
+        """
+        :return: Job，未知或已丢弃的任务返回 None
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._manager.shutdown()
+            self._executor = None
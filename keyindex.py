@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+# 多字段键索引：对关键字段统一格式后编码为整数，用于呆滞清单等表的批量匹配
+
+
+def normalize_key(values):
+    """
+    关键字段统一格式：转字符串+去空格，空值统一为 NaN
+    只对去重后的取值做字符串处理
+    :return: (codes, labels) 每行在 labels 中的位置，labels 为统一格式后的取值
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    labels = pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.strip()
+    labels = labels.where(~(pd.isna(np.asarray(uniques, dtype=object)) | labels.isin(['nan', ''])), np.nan)
+    return codes, labels.to_numpy(dtype=object)
+
+
+def _key_values(df, col):
+    values = df[col]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # 分类列只处理类别，编码直接复用
+        codes = values.cat.codes.to_numpy()
+        categories = np.append(values.cat.categories.to_numpy(dtype=object), np.nan)
+        category_codes, labels = normalize_key(categories)
+        return category_codes[codes], labels
+    return normalize_key(values.to_numpy(dtype=object))
+
+
+def normalized_column(df, col):
+    """
+    返回统一格式后的关键字段列；分类列保持分类类型
+    """
+    codes, labels = _key_values(df, col)
+    if isinstance(df[col].dtype, pd.CategoricalDtype):
+        vocab_codes, vocab = pd.factorize(labels)
+        return pd.Categorical.from_codes(vocab_codes[codes], categories=vocab)
+    return labels[codes]
+
+
+class KeyIndex:
+    """
+    按关键字段建立的索引，同一组合只保留第一行
+    用法：
+        index = KeyIndex(df2_res, ['产品编码', '批次号', '所在仓库'])
+        positions = index.lookup(df_res)   # 每行在 df2_res 中匹配到的行号，未匹配为 -1
+    """
+
+    def __init__(self, df, key_cols):
+        missing_cols = [col for col in key_cols if col not in df.columns]
+        if missing_cols:
+            raise ValueError(f"df2 缺少关键字段：{missing_cols}")
+        self.key_cols = list(key_cols)
+        self.df = df
+        self._vocabs = []
+        self._combiners = []
+        key = None
+        for col in self.key_cols:
+            codes, labels = _key_values(df, col)
+            # 同一字段的词表：统一格式后的取值 → 编码
+            vocab_codes, vocab = pd.factorize(labels, use_na_sentinel=False)
+            vocab = pd.Index(vocab, dtype=object)
+            self._vocabs.append(vocab)
+            codes = vocab_codes[codes].astype(np.int64)
+            if key is None:
+                key = codes
+            else:
+                # 逐字段合并为组合编码，并压缩为连续整数避免溢出
+                combined = key * len(vocab) + codes
+                combiner = pd.Index(pd.unique(combined))
+                self._combiners.append((len(vocab), combiner))
+                key = combiner.get_indexer(combined)
+        # 组合键 → 第一次出现的行号（对应 drop_duplicates(keep='first')）
+        unique_keys, first = np.unique(key, return_index=True)
+        self._keys = pd.Index(unique_keys)
+        self._first = first
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _encode(self, df):
+        key = None
+        complete = np.ones(len(df), dtype=bool)
+        for i, col in enumerate(self.key_cols):
+            codes, labels = _key_values(df, col)
+            complete &= ~pd.isna(labels)[codes]
+            mapped = self._vocabs[i].get_indexer(labels)[codes].astype(np.int64)
+            if key is None:
+                key = mapped
+            else:
+                size, combiner = self._combiners[i - 1]
+                found = (key >= 0) & (mapped >= 0)
+                key = np.where(found, combiner.get_indexer(np.where(found, key * size + mapped, -1)), -1)
+        return key, complete
+
+    def lookup(self, df):
+        """
+        :return: (positions, complete) 每行在索引表中的行号（未匹配为 -1），以及关键字段是否齐全
+        """
+        missing_cols = [col for col in self.key_cols if col not in df.columns]
+        if missing_cols:
+            raise ValueError(f"df1 缺少关键字段：{missing_cols}")
+        key, complete = self._encode(df)
+        slot = self._keys.get_indexer(key)
+        # 只对匹配到的行取行号（索引表为空时 self._first 没有元素）
+        positions = np.full(len(key), -1, dtype=np.int64)
+        hit = (key >= 0) & (slot >= 0)
+        positions[hit] = self._first[slot[hit]]
+        return positions, complete
+
+    def contains(self, df):
+        """
+        每行是否在索引表中（关键字段齐全且匹配成功）
+        """
+        positions, complete = self.lookup(df)
+        return (positions >= 0) & complete
+
+    def take(self, positions, columns=None):
+        """
+        按 lookup 的行号取索引表的列，未匹配的行为空值
+        :param columns: 需要的列，默认为除关键字段外的所有列
+        """
+        if columns is None:
+            columns = [col for col in self.df.columns if col not in self.key_cols]
+        return {col: pd.api.extensions.take(self.df[col].to_numpy(), positions, allow_fill=True)
+                for col in columns}
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+# 原实现（逐行判定分类、DataFrame.merge 匹配呆滞清单），仅供 benchmark.py --verify 对比耗时并检查新实现的结果一致，处理流程不使用
+
+
+def classify_items(df):
+    """
+    原 dataprocess.classify_items：逐行 apply，不归类的行为 ""
+    """
+    df = df.copy()
+    df['分类'] = ""
+
+    def assign_classification(row):
+        classification = []
+        if row['效期类别'] == '过效期':
+            classification.append('过期货')
+        elif row['180天无动销'] == '≥180天无动销':
+            classification.append('呆滞品')
+        elif row['效期类别'] == '剩余1/3效期' and row['180天无动销']!= '≥180天无动销':
+            classification.append('临期货')
+        elif row['效期类别'] == '剩余2/3效期' and row['180天无动销']!= '≥180天无动销':
+            classification.append('预警货')
+        return ', '.join(classification)
+
+    df['分类'] = df.apply(assign_classification, axis=1)
+    return df
+
+
+def merge_and_mark(df1, df2, key_cols=['产品编码', '批次号', '所在仓库']):
+    """
+    原 dataprocess.merge_and_mark：复制两个表，关键字段逐行转字符串后 merge
+    """
+    for df, name in [(df1, 'df1'), (df2, 'df2')]:
+        missing_cols = [col for col in key_cols if col not in df.columns]
+        if missing_cols:
+            raise ValueError(f"{name} 缺少关键字段：{missing_cols}")
+    df1_copy = df1.copy(deep=True)
+    df2_copy = df2.copy(deep=True)
+    for col in key_cols:
+        df1_copy[col] = df1_copy[col].astype(str).str.strip().replace(['nan', ''], np.nan)
+        df2_copy[col] = df2_copy[col].astype(str).str.strip().replace(['nan', ''], np.nan)
+    df2_unique = df2_copy.drop_duplicates(subset=key_cols, keep='first')
+    merged_df = df1_copy.merge(
+        df2_unique,
+        on=key_cols,
+        how='left',
+        indicator=True,
+        suffixes=('', '_df2')
+    )
+    merged_df['180天无动销'] = np.where(
+        (merged_df['_merge'] == 'both') &
+        (~merged_df[key_cols].isna().any(axis=1)),
+        '≥180天无动销',
+        None
+    )
+    result_df = merged_df.drop(columns=['_merge'])
+    return result_df
+
+
+def same_values(left, right):
+    """
+    两列取值是否相同（忽略类型，空值与 "" 视为相同）
+    """
+    left = pd.Series(left).astype(object).where(pd.Series(left).notna(), '').reset_index(drop=True)
+    right = pd.Series(right).astype(object).where(pd.Series(right).notna(), '').reset_index(drop=True)
+    return len(left) == len(right) and bool((left == right).all())
@@ -0,0 +1,272 @@
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pandas as pd
+
+from datadir import data_directory
+from keyindex import KeyIndex, normalized_column
+
+# 出入库流水 → 最后动销日期：按 (产品编码, 批次号, 所在仓库) 建立持久化索引，新上传的流水增量更新，
+# 任意月末日期的"≥180天无动销"清单都从索引中直接得到，不再重新扫描历史流水
+KEY_COLUMNS = ['产品编码', '批次号', '所在仓库']
+MOVEMENT_DATE_COLUMN = '业务日期'
+LAST_MOVEMENT_COLUMN = '最后动销日期'
+IDLE_DAYS_COLUMN = '无动销天数'
+STALE_DAYS = 180
+DEFAULT_DIRECTORY = data_directory('movements')
+# 组合编码：键编号 × DAY_SPAN + 日期（1970-01-01 起的天数）
+DAY_SPAN = 1 << 20
+KEYS_FILE = 'keys.parquet'
+MOVEMENTS_FILE = 'movements.parquet'
+META_FILE = 'meta.json'
+# 每次保存写入新的版本目录，元数据文件指向当前版本；更新时持有锁文件
+VERSION_PREFIX = 'v-'
+LOCK_FILE = 'update.lock'
+
+
+def _normalized_keys(df):
+    """
+    关键字段统一格式（与 merge_and_mark 相同），返回只含关键字段的 DataFrame
+    """
+    missing_cols = [col for col in KEY_COLUMNS if col not in df.columns]
+    if missing_cols:
+        raise ValueError(f"出入库流水缺少字段：{missing_cols}")
+    return pd.DataFrame({col: np.asarray(normalized_column(df, col), dtype=object) for col in KEY_COLUMNS})
+
+
+def _day_numbers(dates):
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+class MovementIndex:
+    """
+    每个 (产品编码, 批次号, 所在仓库) 有动销的日期（按天去重），按 (键编号, 日期) 排序保存
+    用法：
+        index = MovementIndex.load(directory)
+        index.update(ingest.read_ledger(file))
+        index.save(directory)                    # 多个进程同时更新时用 update_index(ledger, directory)
+        df2 = index.stale_list('2024-12-31')     # 与呆滞数据文件相同的关键字段，可直接用于 merge_and_mark
+    """
+
+    def __init__(self, keys=None, pairs=None, version=None):
+        """
+        :param keys: 关键字段表，行号即键编号
+        :param pairs: 排序后的组合编码（键编号 × DAY_SPAN + 日期）
+        """
+        self.keys = keys if keys is not None else pd.DataFrame({col: pd.Series(dtype=object) for col in KEY_COLUMNS})
+        self.pairs = pairs if pairs is not None else np.empty(0, dtype=np.int64)
+        self.version = version
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def max_date(self):
+        """
+        流水中最晚的日期
+        """
+        if not len(self.pairs):
+            return None
+        return pd.Timestamp(int((self.pairs % DAY_SPAN).max()), unit='D')
+
+    def update(self, ledger):
+        """
+        合并一批流水：新出现的键追加到关键字段表，(键, 日期) 去重后并入
+        :param ledger: 出入库流水，需包含 KEY_COLUMNS 和 MOVEMENT_DATE_COLUMN
+        :return: 本批流水涉及的键数
+        """
+        if MOVEMENT_DATE_COLUMN not in ledger.columns:
+            raise ValueError(f"出入库流水缺少字段：{[MOVEMENT_DATE_COLUMN]}")
+        keys = _normalized_keys(ledger)
+        days = pd.to_datetime(ledger[MOVEMENT_DATE_COLUMN], errors='coerce').to_numpy()
+        # 关键字段不全或日期无效的行不计
+        valid = keys.notna().all(axis=1).to_numpy() & ~np.isnat(days)
+        keys, days = keys[valid], _day_numbers(days[valid])
+        days_valid = (days >= 0) & (days < DAY_SPAN)
+        keys, days = keys[days_valid], days[days_valid]
+        if not len(keys):
+            return 0
+        positions = self._positions(keys)
+        if (positions < 0).any():
+            # 新出现的键按首次出现顺序追加，已有键的编号不变
+            unmatched = positions < 0
+            new_keys = keys[unmatched].drop_duplicates()
+            new_positions, _ = KeyIndex(new_keys, KEY_COLUMNS).lookup(keys[unmatched])
+            positions[unmatched] = len(self.keys) + new_positions
+            self.keys = pd.concat([self.keys, new_keys], ignore_index=True)
+        # 一次排序去重：同一键同一天的多笔流水只保留一条
+        pairs = np.unique(positions.astype(np.int64) * DAY_SPAN + days)
+        self.pairs = np.union1d(self.pairs, pairs)
+        self.version = uuid.uuid4().hex
+        return len(np.unique(positions))
+
+    def _positions(self, keys):
+        if not len(self.keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        positions, _ = KeyIndex(self.keys, KEY_COLUMNS).lookup(keys)
+        return positions
+
+    def last_movement(self, as_of=None):
+        """
+        每个键在 as_of（含）之前的最后动销日期
+        :param as_of: 截止日期，默认不限
+        :return: 关键字段 + 最后动销日期；截止日期前没有流水的键不返回
+        """
+        codes = np.arange(len(self.keys), dtype=np.int64)
+        limit = DAY_SPAN - 1 if as_of is None else _day_numbers([pd.Timestamp(as_of)])[0]
+        # 在排序的组合编码中二分查找每个键不晚于截止日期的最后一条
+        found = np.searchsorted(self.pairs, codes * DAY_SPAN + limit, side='right') - 1
+        found_valid = found >= 0
+        found_valid[found_valid] = self.pairs[found[found_valid]] // DAY_SPAN == codes[found_valid]
+        result = self.keys[found_valid].reset_index(drop=True)
+        days = self.pairs[found[found_valid]] % DAY_SPAN
+        result[LAST_MOVEMENT_COLUMN] = days.astype('datetime64[D]').astype('datetime64[ns]')
+        return result
+
+    def stale_list(self, as_of, days=STALE_DAYS):
+        """
+        截至 as_of 已连续 days 天以上无动销的键，格式同呆滞数据文件（附最后动销日期、无动销天数）
+        """
+        result = self.last_movement(as_of)
+        idle = (pd.Timestamp(as_of) - result[LAST_MOVEMENT_COLUMN]).dt.days
+        result[IDLE_DAYS_COLUMN] = idle
+        return result[idle >= days].reset_index(drop=True)
+
+    def save(self, directory=DEFAULT_DIRECTORY):
+        """
+        保存到目录：数据写入新的版本目录，再改名替换元数据文件切换到该版本，读取方总是读到同一版本的两个文件；
+        保存时持有更新锁。多个进程并入流水时应使用 update_index（读取、并入、保存都在锁内），
+        否则 load → update → save 之间其他进程保存的流水会被覆盖
+        """
+        with update_lock(directory):
+            self._save(directory)
+
+    def _save(self, directory):
+        version = self.version or uuid.uuid4().hex
+        version_dir = os.path.join(directory, VERSION_PREFIX + version)
+        if not os.path.isdir(version_dir):
+            os.makedirs(version_dir)
+            self.keys.to_parquet(os.path.join(version_dir, KEYS_FILE), index=False)
+            pd.DataFrame({'pair': self.pairs}).to_parquet(os.path.join(version_dir, MOVEMENTS_FILE), index=False)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        _write_json(tmp, {
+            'version': version, 'keys': len(self.keys), 'movements': len(self.pairs),
+            'max_date': str(self.max_date.date()) if self.max_date is not None else None})
+        os.replace(tmp, os.path.join(directory, META_FILE))
+        self.version = version
+        # 删除旧版本（正在读取旧版本的进程会重新读取元数据，见 load）
+        for name in os.listdir(directory):
+            if name.startswith(VERSION_PREFIX) and name != VERSION_PREFIX + version:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory=DEFAULT_DIRECTORY):
+        """
+        从目录读取元数据指向的版本，目录不存在或为空时返回空索引
+        """
+        while True:
+            version = index_version(directory)
+            if version is None:
+                return cls()
+            version_dir = os.path.join(directory, VERSION_PREFIX + version)
+            if not os.path.isdir(version_dir):
+                # 旧的目录结构：数据文件直接放在目录下
+                version_dir = directory
+            try:
+                keys = pd.read_parquet(os.path.join(version_dir, KEYS_FILE))
+                pairs = pd.read_parquet(os.path.join(version_dir, MOVEMENTS_FILE))['pair'].to_numpy(dtype=np.int64)
+            except FileNotFoundError:
+                # 读取期间其他进程保存了新版本并删除了这一版本
+                if index_version(directory) == version:
+                    raise
+                continue
+            return cls(keys.astype(object), pairs, version)
+
+
+@contextmanager
+def update_lock(directory=DEFAULT_DIRECTORY):
+    """
+    动销索引的更新锁（跨进程），同一目录同时只有一个 读取 → 并入 → 保存；进程退出时系统自动释放
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK 重试约 10 秒后仍未拿到锁，继续等待
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def update_index(ledger, directory=DEFAULT_DIRECTORY):
+    """
+    把一批流水并入目录中的动销索引并保存；持有更新锁，多个进程同时上传的流水都会保留
+    :param ledger: 出入库流水，见 MovementIndex.update
+    :return: 更新后的 MovementIndex
+    """
+    with update_lock(directory):
+        index = MovementIndex.load(directory)
+        index.update(ledger)
+        index._save(directory)
+    return index
+
+
+def _write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def index_version(directory=DEFAULT_DIRECTORY):
+    """
+    已保存索引的版本号，没有索引时返回 None；只读取元数据文件
+    """
+    try:
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as f:
+            return json.load(f)['version']
+    except FileNotFoundError:
+        return None
+
+
+def stale_keys(as_of, stale=None, index=None, days=STALE_DAYS):
+    """
+    呆滞清单：上传的呆滞数据与由出入库流水得到的无动销清单合并
+    :param stale: 呆滞数据（可为 None）
+    :param index: MovementIndex（可为 None）
+    :return: 只含关键字段的 DataFrame，可作为 read_data 的 df2；截至 as_of 没有无动销的批次时为空表
+             （如第一次上传近期的流水），merge_and_mark 不标记任何行
+    """
+    frames = []
+    if stale is not None:
+        frames.append(stale[KEY_COLUMNS])
+    if index is not None:
+        frames.append(index.stale_list(as_of, days)[KEY_COLUMNS])
+    if not frames:
+        raise ValueError("需要呆滞数据文件或出入库流水")
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat([frame.astype(object) for frame in frames], ignore_index=True)
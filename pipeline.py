@@ -0,0 +1,177 @@
+import csv
+import json
+import os
+import tomllib
+from datetime import date
+
+import pandas as pd
+
+import dataprocess as dp
+import ingest
+from chunked import build_report_chunked
+from cube import build_cube
+from delta import build_delta, delta_to_excel
+from history import HistoryStore, month_of
+from movement import MovementIndex, stale_keys, update_index
+from exporters import DEFAULT_FORMAT, export
+from profiling import StageProfiler
+
+# 不依赖 streamlit 的处理流程，供页面、命令行和批处理共用
+WAREHOUSE_SECTION = 'ccp_warehouse'
+
+
+def load_warehouse_mapping(path):
+    """
+    读取 所在仓库 → 仓库分类 映射文件
+    - .toml：与 .streamlit/secrets.toml 相同格式，读取 [ccp_warehouse] 段（没有该段时读取整个文件）
+    - .json：{"所在仓库": "仓库分类", ...}
+    - .csv/.xlsx：前两列分别为 所在仓库、仓库分类
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.toml':
+        with open(path, 'rb') as f:
+            data = tomllib.load(f)
+        return dict(data.get(WAREHOUSE_SECTION, data))
+    if ext == '.json':
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return dict(data.get(WAREHOUSE_SECTION, data))
+    if ext == '.csv':
+        df = pd.read_csv(path, dtype=str)
+    elif ext in ('.xlsx', '.xls'):
+        df = pd.read_excel(path, dtype=str)
+    else:
+        raise ValueError(f"不支持的仓库映射文件格式：{path}")
+    return dict(zip(df.iloc[:, 0].str.strip(), df.iloc[:, 1].str.strip()))
+
+
+def process(df1, df2, date_value, cp_warehouses, profiler=None, compact=True, history=None):
+    """
+    从读取的原始数据到各明细表
+    :param df1: 库存信息
+    :param df2: 呆滞数据
+    :param date_value: 月末日期
+    :param cp_warehouses: 所在仓库 → 仓库分类 映射
+    :param profiler: StageProfiler，默认不记录
+    :param compact: 为 True 时按 dataprocess 的类型声明转换列类型、日期保持 datetime64，并在写时复制模式下运行
+    :param history: HistoryStore，指定时 sort_and_filter 的明细写入该月的历史数据（覆盖同月已有数据）
+    :return: df_s11, df_s12, df_s2, df_s3, df_s4, df_s5
+    """
+    profiler = profiler if profiler is not None else StageProfiler(enabled=False)
+    # 写时复制：各步骤只做浅拷贝，修改列时才复制对应的数据
+    with pd.option_context('mode.copy_on_write', compact):
+        df_res, df2_res = profiler.run('read_data', dp.read_data, df1, df2, cp_warehouses)
+        if compact:
+            df_res = profiler.run('apply_schema', dp.apply_schema, df_res)
+            df2_res = dp.apply_schema(df2_res)
+        df_res = profiler.run('calculate_expiry', dp.calculate_expiry, df_res, date_value, compact)
+        df_res = profiler.run('expiry_classification', dp.expiry_classification, df_res)
+        df_res = profiler.run('merge_and_mark', dp.merge_and_mark, df_res, df2_res)
+        df_res = profiler.run('classify_items', dp.classify_items, df_res)
+        df_res = profiler.run('filter_and_calculate', dp.filter_and_calculate, df_res)
+        df_res = profiler.run('sort_and_filter', dp.sort_and_filter, df_res)
+        if history is not None:
+            profiler.run('append_history', history.append, df_res, date_value)
+        return profiler.run('filter_special_cases', dp.filter_special_cases, df_res)
+
+
+def build_outputs(df1, df2, date_value, cp_warehouses, profiler=None, compact=True, history=None, delta=False,
+                  export_format=DEFAULT_FORMAT):
+    """
+    处理数据，生成 Excel 报表和汇总立方体（供页面预览）
+    :param history: HistoryStore，见 process
+    :param delta: 为 True 时只导出与历史数据中上一个月份相比的变化（见 delta，总是 xlsx），需要 history
+    :param export_format: 导出格式，见 exporters.EXPORTERS
+    :return: (报表文件的字节串, 汇总立方体)
+    """
+    if delta and history is None:
+        raise ValueError("变化报表需要历史数据目录")
+    profiler = profiler if profiler is not None else StageProfiler(enabled=False)
+    frames = process(df1, df2, date_value, cp_warehouses, profiler, compact, history)
+    cube = profiler.run('summary_cube', build_cube, frames)
+    df2 = dp.generate_description_df()
+    if delta:
+        changes, base_month = profiler.run('compare_history', build_delta, history, date_value)
+        excel_file = profiler.run('to_excel', delta_to_excel, changes, base_month, month_of(date_value), df2)
+    else:
+        excel_file = profiler.run('to_excel', export, export_format, frames, df2, cube)
+    return excel_file, cube
+
+
+def build_report(df1, df2, date_value, cp_warehouses, profiler=None, compact=True):
+    """
+    处理数据并生成 Excel 报表
+    :return: xlsx 文件的字节串
+    """
+    return build_outputs(df1, df2, date_value, cp_warehouses, profiler, compact)[0]
+
+
+def _paths(files):
+    # 单个路径或路径列表；任务清单中多个文件以分号分隔
+    if isinstance(files, str):
+        return [path.strip() for path in files.split(';') if path.strip()]
+    return list(files)
+
+
+def run_job(inventory, stale, date_value, warehouses, output, batch_size=None, ledger=None, movement_dir=None,
+            history_dir=None, delta=False, export_format=DEFAULT_FORMAT, read_workers=None):
+    """
+    处理一组文件并写出报表，可在子进程中运行
+    :param inventory: 库存数据文件，多个文件时为列表（或以分号分隔），合并处理并记录来源文件
+    :param stale: 呆滞数据文件，多个文件同上；指定 movement_dir 时可为空
+    :param date_value: 月末日期（date 或 'YYYY-MM-DD'）
+    :param warehouses: 仓库映射文件路径或映射字典
+    :param output: 输出文件路径（xlsx，Parquet/CSV 格式为 zip）
+    :param batch_size: 指定时按批读取和处理库存数据（见 chunked），内存占用与库存总行数无关
+    :param ledger: 出入库流水文件，并入 movement_dir 中的动销索引
+    :param movement_dir: 动销索引目录，指定时由索引得到无动销清单（与呆滞数据合并）
+    :param history_dir: 历史数据目录，指定时该月的明细写入历史数据
+    :param delta: 为 True 时只输出与历史数据中上一个月份相比的变化，需要 history_dir
+    :param export_format: 导出格式，见 exporters.EXPORTERS
+    :param read_workers: 并行读取多个文件的进程数，默认为 CPU 核数；在进程池中运行时应设为 1
+    :return: 各步骤耗时记录
+    """
+    if isinstance(date_value, str):
+        date_value = date.fromisoformat(date_value)
+    cp_warehouses = load_warehouse_mapping(warehouses) if isinstance(warehouses, str) else warehouses
+    inventory, stale = _paths(inventory), _paths(stale or [])
+    profiler = StageProfiler()
+    output_dir = os.path.dirname(output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    df2 = profiler.run('read_stale', ingest.read_many, stale, ingest.read_stale, read_workers) if stale else None
+    index = None
+    if movement_dir:
+        if ledger:
+            index = profiler.run('update_movements', update_index,
+                                 ingest.read_many(_paths(ledger), ingest.read_ledger, read_workers), movement_dir)
+        else:
+            index = MovementIndex.load(movement_dir)
+    df2 = stale_keys(date_value, df2, index)
+    history = HistoryStore(history_dir) if history_dir else None
+    if batch_size:
+        build_report_chunked(ingest.iter_many(inventory, batch_size), df2, date_value, cp_warehouses,
+                             output=output, profiler=profiler, history=history, delta=delta,
+                             export_format=export_format)
+        return profiler.records
+    df1 = profiler.run('read_inventory', ingest.read_many, inventory, ingest.read_inventory, read_workers)
+    excel_file, _ = build_outputs(df1, df2, date_value, cp_warehouses, profiler, history=history, delta=delta,
+                                  export_format=export_format)
+    with open(output, 'wb') as f:
+        f.write(excel_file)
+    return profiler.records
+
+
+def read_jobs(path):
+    """
+    读取批处理任务清单（CSV），列：inventory, stale, date, output，可选列 warehouses；
+    inventory/stale 有多个文件时以分号分隔；使用动销索引时 stale 可为空
+    """
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        jobs = list(csv.DictReader(f))
+    required = ['inventory', 'date', 'output']
+    for job in jobs:
+        missing_cols = [col for col in required if not job.get(col)]
+        if missing_cols:
+            raise ValueError(f"任务清单缺少字段：{missing_cols}")
+    return jobs
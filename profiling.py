@@ -0,0 +1,148 @@
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows 下没有 resource 模块，峰值内存只在开启 tracemalloc 时记录
+    resource = None
+
+# 数据处理各步骤的耗时记录：墙钟时间、峰值内存增量、输入/输出行数，可对单个步骤开启 cProfile/tracemalloc
+PIPELINE_STAGES = [
+    'read_data',
+    'apply_schema',
+    'calculate_expiry',
+    'expiry_classification',
+    'merge_and_mark',
+    'classify_items',
+    'filter_and_calculate',
+    'sort_and_filter',
+    'append_history',
+    'filter_special_cases',
+    'summary_cube',
+    'compare_history',
+    'to_excel',
+]
+
+
+def _peak_rss():
+    """
+    进程峰值常驻内存（字节），不支持的平台返回 None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def count_rows(value):
+    """
+    DataFrame 返回行数，DataFrame 组成的元组返回行数之和，其他返回 None
+    """
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        counts = [len(item) for item in value if isinstance(item, pd.DataFrame)]
+        return sum(counts) if counts else None
+    return None
+
+
+class StageProfiler:
+    """
+    逐步骤记录处理耗时
+    用法：
+        profiler = StageProfiler(profile_stage='merge_and_mark')
+        df_res = profiler.run('merge_and_mark', dp.merge_and_mark, df_res, df2_res)
+        profiler.to_frame()
+    """
+
+    def __init__(self, profile_stage=None, trace_stage=None, top=20, enabled=True, on_stage=None):
+        """
+        :param profile_stage: 开启 cProfile 的步骤名
+        :param trace_stage: 开启 tracemalloc 的步骤名
+        :param top: 分析结果保留的条目数
+        :param enabled: 为 False 时只调用函数，不做记录
+        :param on_stage: 每个步骤开始前以步骤名调用，用于报告进度
+        """
+        self.profile_stage = profile_stage
+        self.trace_stage = trace_stage
+        self.top = top
+        self.enabled = enabled
+        self.on_stage = on_stage
+        self.records = []
+
+    def run(self, stage, func, *args, **kwargs):
+        if self.on_stage is not None:
+            self.on_stage(stage)
+        if not self.enabled:
+            return func(*args, **kwargs)
+        record = {
+            'stage': stage,
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'rows_in': count_rows(args[0]) if args else None,
+        }
+        profiler = cProfile.Profile() if stage == self.profile_stage else None
+        tracing = stage == self.trace_stage and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+        rss_before = _peak_rss()
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            rss_after = _peak_rss()
+            record['peak_rss_delta'] = rss_after - rss_before if rss_before is not None else None
+            if tracing:
+                record['traced_peak'] = tracemalloc.get_traced_memory()[1]
+                after = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                record['allocations'] = [str(stat) for stat in after.compare_to(before, 'lineno')[:self.top]]
+            if profiler is not None:
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(self.top)
+                record['profile'] = stream.getvalue()
+            self.records.append(record)
+        record['rows_out'] = count_rows(result)
+        return result
+
+    def to_frame(self):
+        """
+        各步骤的耗时表（不含 cProfile/tracemalloc 明细）
+        """
+        columns = ['stage', 'seconds', 'rows_in', 'rows_out', 'peak_rss_delta', 'traced_peak']
+        df = pd.DataFrame(self.records, columns=columns)
+        return df.rename(columns={
+            'stage': '步骤',
+            'seconds': '耗时(秒)',
+            'rows_in': '输入行数',
+            'rows_out': '输出行数',
+            'peak_rss_delta': '峰值内存增量(字节)',
+            'traced_peak': 'tracemalloc峰值(字节)',
+        })
+
+    def write_jsonl(self, file, **extra):
+        """
+        以 JSON lines 格式追加写入日志，每个步骤一行
+        :param file: 文件路径或文本文件对象
+        :param extra: 附加到每行的字段，如 date_value
+        """
+        lines = [json.dumps({**extra, **record}, ensure_ascii=False, default=str) + '\n' for record in self.records]
+        if hasattr(file, 'write'):
+            file.writelines(lines)
+        else:
+            with open(file, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
@@ -0,0 +1,170 @@
+import glob
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+from datadir import data_directory, private_directory
+
+# 生成结果的磁盘存储：报表写入本地目录，按任务号（输入文件内容哈希 + 月末日期等）存放，
+# 超过有效期或总大小超出上限时删除，内存中只保留文件路径
+DEFAULT_DIRECTORY = data_directory('results')
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# 报表文件的默认后缀；其他导出格式按各自的后缀保存（如 .zip）
+WORKBOOK_SUFFIX = '.xlsx'
+META_SUFFIX = '.pkl'
+TMP_SUFFIX = '.tmp'
+
+
+class ResultStore:
+    """
+    报表结果存储，可在多个进程间共用同一目录
+    每个结果两个文件：<key>.xlsx（或写入时指定的后缀）为报表，<key>.pkl 为附带信息（汇总立方体、导出格式、耗时记录等）
+    - 有效期从写入时算起（附带信息文件的修改时间）
+    - 总大小超出上限时按最近访问时间（报表文件的修改时间，读取时更新）淘汰
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param directory: 存储目录，不存在时创建（只有当前用户可访问，见 private_directory）
+        :param ttl: 有效期（秒）
+        :param max_bytes: 报表文件总大小上限（字节）
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        private_directory(directory)
+
+    def __getstate__(self):
+        # 传给子进程时不带锁
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def path(self, key, suffix=WORKBOOK_SUFFIX):
+        """
+        报表文件路径（不检查是否存在）
+        """
+        return os.path.join(self.directory, key + suffix)
+
+    def _report_path(self, key):
+        """
+        已保存的报表文件路径（后缀为写入时指定的），不存在时返回 None
+        """
+        for path in glob.glob(os.path.join(glob.escape(self.directory), glob.escape(key) + '.*')):
+            if not path.endswith((META_SUFFIX, TMP_SUFFIX)):
+                return path
+        return None
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, key + META_SUFFIX)
+
+    def _expired(self, key, now):
+        # 先写附带信息再写报表，报表存在而附带信息不存在时视为已失效
+        try:
+            return now - os.path.getmtime(self._meta_path(key)) > self.ttl
+        except FileNotFoundError:
+            return True
+
+    def get(self, key):
+        """
+        :return: (报表文件路径, 附带信息)，不存在或已过期时返回 None
+        """
+        with self._lock:
+            path = self._report_path(key)
+            if path is None:
+                return None
+            if self._expired(key, time.time()):
+                self._remove(key)
+                return None
+            try:
+                with open(self._meta_path(key), 'rb') as f:
+                    meta = pickle.load(f)
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+        return path, meta
+
+    def put(self, key, excel_file, meta=None, suffix=WORKBOOK_SUFFIX):
+        """
+        写入结果：先写临时文件再改名，读取方不会看到写了一半的文件；报表最后写入，报表存在即表示写入完成
+        :param excel_file: 报表字节串
+        :param meta: 附带信息（可 pickle 的对象）
+        :param suffix: 报表文件后缀，按导出格式，如 '.xlsx'、'.zip'
+        :return: 报表文件路径
+        """
+        path = self.path(key, suffix)
+        for target, data in ((self._meta_path(key), pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL)),
+                             (path, excel_file)):
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=TMP_SUFFIX)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, target)
+        return path
+
+    def _remove(self, key):
+        for target in (self._report_path(key), self._meta_path(key)):
+            if target is None:
+                continue
+            try:
+                os.remove(target)
+            except FileNotFoundError:
+                pass
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            key, suffix = os.path.splitext(name)
+            if suffix and suffix not in (META_SUFFIX, TMP_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, key))
+        return entries
+
+    def evict(self):
+        """
+        删除过期结果，总大小超出上限时删除最久未访问的结果
+        :return: 删除的结果数
+        """
+        now = time.time()
+        removed = 0
+        with self._lock:
+            kept = []
+            for entry in self._entries():
+                if self._expired(entry[2], now):
+                    self._remove(entry[2])
+                    removed += 1
+                else:
+                    kept.append(entry)
+            # 写入中断留下的临时文件
+            for name in os.listdir(self.directory):
+                if name.endswith(TMP_SUFFIX):
+                    tmp = os.path.join(self.directory, name)
+                    try:
+                        if now - os.path.getmtime(tmp) > self.ttl:
+                            os.remove(tmp)
+                    except FileNotFoundError:
+                        pass
+            total = sum(size for _, size, _ in kept)
+            for _, size, key in sorted(kept):
+                if total <= self.max_bytes:
+                    break
+                self._remove(key)
+                total -= size
+                removed += 1
+        return removed
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def __contains__(self, key):
+        return self._report_path(key) is not None and not self._expired(key, time.time())
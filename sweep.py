@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import dataprocess as dp
+
+# 多个月末日期一次计算：效期矩阵（行 × 日期）整体广播，与日期无关的步骤只做一次
+DAY_NS = 24 * 60 * 60 * 10 ** 9
+
+
+def _days_between(end, start):
+    """
+    end - start 的天数（向下取整，与 Series.dt.days 一致），任一侧为空时结果为 NaN
+    :param end: datetime64[ns] 数组
+    :param start: datetime64[ns] 数组，可与 end 广播
+    """
+    end = np.asarray(end, dtype='datetime64[ns]')
+    start = np.asarray(start, dtype='datetime64[ns]')
+    missing = np.isnat(end) | np.isnat(start)
+    diff = end.view(np.int64) - start.view(np.int64)
+    days = np.floor_divide(diff, DAY_NS).astype(float)
+    days[missing] = np.nan
+    return days
+
+
+def _as_column(values):
+    # 无空值时保持整数类型，与 calculate_expiry 的结果一致
+    if np.isnan(values).any():
+        return values
+    return values.astype(np.int64)
+
+
+class ExpirySweep:
+    """
+    按一组月末日期批量计算效期分类
+    用法：
+        sweep = ExpirySweep(df_res, df2_res, ['2024-10-31', '2024-11-30', '2024-12-31'])
+        sweep.summary()                # 每个日期按 分类/仓库分类 汇总
+        sweep.detail('2024-12-31')     # 某个日期的明细，与单日期流程 sort_and_filter 的结果相同
+    """
+
+    def __init__(self, df, df2, date_values):
+        """
+        :param df: read_data 返回的库存数据
+        :param df2: read_data 返回的呆滞数据
+        :param date_values: 月末日期列表
+        """
+        self.dates = pd.DatetimeIndex(pd.to_datetime(list(date_values)))
+        # 与日期无关的步骤只做一次：呆滞匹配、数量
+        base = dp.merge_and_mark(df, df2)
+        expiry = pd.to_datetime(base['失效日期'])
+        produce = pd.to_datetime(base['生产日期'])
+        total = _days_between(expiry.to_numpy(), produce.to_numpy())
+        # 剩余效期天数与效期占比：行 × 日期
+        self.remaining = _days_between(expiry.to_numpy()[:, None], self.dates.to_numpy()[None, :])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.ratio = self.remaining / total[:, None]
+        self.expiry_codes = dp.expiry_codes(self.ratio)
+        stale = (base['180天无动销'] == dp.STALE_FLAG).to_numpy(dtype=np.int8)
+        self.class_codes = dp.CLASSIFICATION_TABLE[stale[:, None], self.expiry_codes]
+        base['效期'] = _as_column(total)
+        base['失效日期'] = expiry.dt.strftime('%Y-%m-%d')
+        base['生产日期'] = produce.dt.strftime('%Y-%m-%d')
+        base['数量'] = dp.calculate_quantity(base)
+        self.base = base
+
+    def _date_index(self, date_value):
+        date_value = pd.to_datetime(date_value)
+        if date_value not in self.dates:
+            raise ValueError(f"日期 {date_value:%Y-%m-%d} 不在计算范围内")
+        return self.dates.get_loc(date_value)
+
+    def detail(self, date_value):
+        """
+        返回指定日期的分类明细
+        """
+        j = self._date_index(date_value)
+        df = self.base.drop(columns=['数量'])
+        df['剩余效期天数'] = _as_column(self.remaining[:, j])
+        df['%(剩余效期/总效期)'] = self.ratio[:, j]
+        df['效期类别'] = pd.Categorical.from_codes(self.expiry_codes[:, j], categories=dp.EXPIRY_CATEGORIES)
+        df['分类'] = pd.Categorical.from_codes(self.class_codes[:, j], categories=dp.CATEGORY_ORDER, ordered=True)
+        df = dp.filter_and_calculate(df)
+        return dp.sort_and_filter(df)
+
+    def summary(self, by='仓库分类'):
+        """
+        每个日期按 分类 和指定维度汇总：SKU个数（产品编码去重）、件数、数量
+        :param by: 汇总维度，默认 仓库分类
+        """
+        n_dates = len(self.dates)
+        n_classes = len(dp.CATEGORY_ORDER)
+        group_codes, groups = pd.factorize(self.base[by], sort=True, use_na_sentinel=False)
+        sku_codes, skus = pd.factorize(self.base['产品编码'])
+        quantity = self.base['数量'].to_numpy(dtype=float)
+        pieces = self.base['库存总件数'].to_numpy(dtype=float)
+        # 与 filter_and_calculate 一致：只统计已归类且数量为正的行
+        keep = (self.class_codes >= 0) & (quantity > 0)[:, None]
+        rows, cols = np.nonzero(keep)
+        # 组合键：日期 × 分类 × 维度
+        key = (cols * n_classes + self.class_codes[rows, cols]) * len(groups) + group_codes[rows]
+        size = n_dates * n_classes * len(groups)
+        pieces_sum = np.bincount(key, weights=pieces[rows], minlength=size)
+        quantity_sum = np.bincount(key, weights=quantity[rows], minlength=size)
+        # 去重 SKU 个数：对 (组合键, 产品编码) 去重后计数，空编码不计
+        valid = sku_codes[rows] >= 0
+        pairs = np.unique(key[valid].astype(np.int64) * max(len(skus), 1) + sku_codes[rows][valid])
+        sku_count = np.bincount(pairs // max(len(skus), 1), minlength=size)
+        index = pd.MultiIndex.from_product(
+            [self.dates, pd.CategoricalIndex(dp.CATEGORY_ORDER, categories=dp.CATEGORY_ORDER, ordered=True), groups],
+            names=['日期', '分类', by])
+        result = pd.DataFrame({'SKU个数': sku_count, '件数': pieces_sum, '数量': quantity_sum}, index=index)
+        # 只保留有数据的组合
+        result = result[(result['SKU个数'] > 0) | (result['件数'] != 0)]
+        return result.reset_index()
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+# 模拟数据生成：按门户系统导出的库存/呆滞报表格式生成测试用数据，用于性能测试
+
+# 所在仓库 → 仓库分类（格式与 st.secrets["ccp_warehouse"] 相同）
+WAREHOUSE_MAPPING = {
+    'JKYZ00口腔成品仓': '正常品种销售',
+    'JKYZ00口腔外销仓': '正常品种销售',
+    'JKYZ00器械成品仓': '正常品种销售',
+    'JKRH00洗护成品仓': '正常品种销售',
+    'JKRH00洗护外销仓': '正常品种销售',
+    'JKCP电商仓': '电商',
+    'JKYZ00电商仓': '电商',
+    'JKYZ00促销品仓': '促销品',
+    'JKRH00促销品仓': '促销品',
+    'JKCP非卖品仓': '非卖品',
+}
+# 未配置映射的仓库，read_data 会过滤掉
+UNMAPPED_WAREHOUSES = ['JKYZ00待检仓', 'JKRH00退货仓']
+
+PRODUCT_DESCRIPTIONS = [
+    '云南白药牙膏(留兰香型)15g',
+    '云南白药牙膏(薄荷清爽型)115g',
+    '云南白药牙膏(益优清新)180g',
+    '云南白药金口健牙膏145g',
+    '云南白药牙膏旅行装15g×2',
+    '达那卡牙膏(清新型)120g',
+    '达那卡焕白牙膏100g',
+    '齿说漱口水500ml',
+    '齿说牙膏(亮白)15g',
+    '云南白药儿童牙刷',
+    '云南白药冲牙器',
+    '养元青洗发水(控油)400ml',
+    '养元青护发素200ml',
+    '养元青沐浴露500ml',
+]
+PRODUCT_SPECS = [12, 24, 36, 48, 60]
+# 总效期（天）
+SHELF_LIFE_DAYS = [730, 1095, 1095, 1826]
+INVENTORY_HEADER_EXTRA = ['序号', '库存组织', '计量单位', '销售可用件数', '零货件数', '破损件数', '冻结件数', '备注']
+
+
+def make_inventory(n_rows, as_of='2024-12-31', n_products=3000, n_batches=600, seed=0, fractional=0.0):
+    """
+    生成库存数据（列与门户系统导出一致，包含 read_data 不使用的列）
+    :param n_rows: 行数
+    :param as_of: 月末日期，生产日期在此之前 0~4 年内分布，保证各效期类别都有数据
+    :param fractional: 库存总件数为小数（零货）的行的比例，其中约一成为空，用于检查非整数件数的处理
+    """
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(0, n_products, n_rows)
+    descriptions = np.array(PRODUCT_DESCRIPTIONS, dtype=object)[product_ids % len(PRODUCT_DESCRIPTIONS)]
+    warehouses = np.array(list(WAREHOUSE_MAPPING) + UNMAPPED_WAREHOUSES, dtype=object)
+    shelf_life = rng.choice(SHELF_LIFE_DAYS, n_rows)
+    produced = pd.Timestamp(as_of) - pd.to_timedelta(rng.integers(0, 4 * 365, n_rows), unit='D')
+    expires = produced + pd.to_timedelta(shelf_life, unit='D')
+    expires = pd.Series(expires).where(rng.random(n_rows) > 0.001)  # 少量失效日期缺失
+    pieces = rng.integers(0, 300, n_rows)
+    pieces[rng.random(n_rows) < 0.02] = 0
+    if fractional:
+        # 单独的随机数序列，其他列与 fractional=0 时相同
+        loose_rng = np.random.default_rng(seed + 1)
+        loose = loose_rng.random(n_rows) < fractional
+        pieces = pieces.astype(np.float64)
+        pieces[loose] += loose_rng.integers(1, 10, n_rows)[loose] / 10
+        pieces[loose & (loose_rng.random(n_rows) < 0.1)] = np.nan
+    df = pd.DataFrame({
+        '序号': np.arange(1, n_rows + 1),
+        '库存组织': rng.choice(['JKYZ00', 'JKCP', 'JKRH00'], n_rows),
+        '产品说明': descriptions,
+        '产品编码': pd.Series(product_ids).map('{:08d}'.format).radd('6901'),
+        '品规': rng.choice(PRODUCT_SPECS, n_rows),
+        '计量单位': '箱',
+        '库存总件数(销售可用+零货+破损+冻结)': pieces,
+        '销售可用件数': pieces,
+        '零货件数': 0,
+        '破损件数': 0,
+        '冻结件数': 0,
+        '批次': pd.Series(rng.integers(0, n_batches, n_rows)).map('B{:06d}'.format),
+        '失效日期': expires.to_numpy(),
+        '生产日期': produced,
+        '所在仓库': warehouses[rng.integers(0, len(warehouses), n_rows)],
+        '备注': None,
+    })
+    return df
+
+
+def make_stale(inventory, fraction=0.08, n_unmatched=200, seed=1):
+    """
+    生成呆滞数据：从库存中抽取一部分 (产品编码, 批次号, 所在仓库)，并加入少量不匹配的行和带空格的编码
+    """
+    rng = np.random.default_rng(seed)
+    picked = inventory.sample(frac=fraction, random_state=seed)
+    df = pd.DataFrame({
+        '产品编码': picked['产品编码'].to_numpy(dtype=object),
+        '批次号': picked['批次'].to_numpy(dtype=object),
+        '所在仓库': picked['所在仓库'].to_numpy(dtype=object),
+        '库龄(天)': rng.integers(180, 720, len(picked)),
+    })
+    # 门户导出的编码偶尔带空格
+    padded = rng.random(len(df)) < 0.05
+    df.loc[padded, '产品编码'] = df.loc[padded, '产品编码'] + ' '
+    unmatched = pd.DataFrame({
+        '产品编码': [f'6909{i:08d}' for i in range(n_unmatched)],
+        '批次号': 'B999999',
+        '所在仓库': rng.choice(list(WAREHOUSE_MAPPING), n_unmatched),
+        '库龄(天)': 365,
+    })
+    return pd.concat([df, unmatched], ignore_index=True)
+
+
+def write_workbook(df, path):
+    """
+    以只写模式写出 xlsx（不带样式），用于测试文件读取
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+    worksheet.append(list(df.columns))
+    for row in df.astype(object).where(df.notna(), None).itertuples(index=False):
+        worksheet.append(list(row))
+    workbook.save(path)
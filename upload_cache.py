@@ -0,0 +1,206 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+import ingest
+from datadir import data_directory, private_directory
+
+# 已解析上传文件的缓存：按文件内容哈希存放读取结果，超出容量时淘汰最久未使用的条目
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# 后台任务的各个子进程共用的磁盘缓存
+DEFAULT_DIRECTORY = data_directory('uploads')
+DEFAULT_DISK_MAX_BYTES = 1024 ** 3
+CACHE_SUFFIX = '.pkl'
+
+
+class FrameCache:
+    """
+    进程内 LRU 缓存，DataFrame 以 pickle 字节串保存（分类列按编码存储，占用较小）
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        # Streamlit 的各个会话运行在不同线程中
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                return None
+            self._items.move_to_end(key)
+        return pickle.loads(data)
+
+    def put(self, key, df):
+        data = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if key in self._items:
+                self.total_bytes -= len(self._items.pop(key))
+            # 单个条目超过容量上限时不缓存
+            if len(data) > self.max_bytes:
+                return
+            self._items[key] = data
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+
+class DiskFrameCache:
+    """
+    磁盘 LRU 缓存，接口同 FrameCache；每个条目一个 pickle 文件，可在多个进程间共用同一目录
+    （后台任务的子进程各自使用 FrameCache 时，只有落在同一进程上的提交能命中，且内存占用按进程数成倍增加）
+    - 目录只有当前用户可访问（见 datadir.private_directory），条目用 pickle 读取
+    - 先写临时文件再改名，读取方不会看到写了一半的文件
+    - 总大小超出上限时按最近访问时间（文件的修改时间，读取时更新）淘汰
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_DISK_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        private_directory(directory)
+
+    def _path(self, key):
+        name = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, name + CACHE_SUFFIX)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return pickle.loads(data)
+
+    def put(self, key, df):
+        data = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        # 单个条目超过容量上限时不缓存
+        if len(data) > self.max_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def evict(self):
+        """
+        总大小超出上限时删除最久未访问的条目（其他进程可能同时删除，已不存在的跳过）
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    @property
+    def total_bytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self):
+        for _, _, name in self._entries():
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+
+def file_digest(file, chunk_size=1024 * 1024):
+    """
+    计算上传文件内容的 SHA-256
+    :param file: 文件路径、带 getvalue() 的上传对象或可 seek 的文件对象
+    """
+    digest = hashlib.sha256()
+    if hasattr(file, 'getvalue'):
+        digest.update(file.getvalue())
+    elif hasattr(file, 'read'):
+        position = file.tell()
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+        file.seek(position)
+    else:
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 进程级共享缓存，所有会话共用
+frame_cache = FrameCache()
+
+
+def read_cached(file, reader, cache=None):
+    """
+    读取上传文件，内容相同的文件直接返回缓存的解析结果
+    :param file: 上传文件
+    :param reader: 解析函数，如 ingest.read_inventory
+    :param cache: 使用的缓存（FrameCache 或 DiskFrameCache），默认为进程级共享缓存
+    """
+    cache = frame_cache if cache is None else cache
+    key = (reader.__module__, reader.__name__, file_digest(file))
+    df = cache.get(key)
+    if df is None:
+        df = reader(file)
+        cache.put(key, df)
+    return df
+
+
+def read_cached_many(files, reader, cache=None, max_workers=None):
+    """
+    读取一个或多个上传文件（结果同 ingest.read_many），已缓存的文件不再解析，其余文件在进程池中并行解析
+    :param files: (文件名, 字节串) 的列表
+    :param max_workers: 解析进程数上限，见 ingest.read_files
+    """
+    files = list(files)
+    if len(files) == 1:
+        return read_cached(ingest.as_file(files[0]), reader, cache)
+    cache = frame_cache if cache is None else cache
+    # 结果带来源文件列，缓存键包含文件名
+    keys = [(reader.__module__, 'read_source', reader.__name__, name, hashlib.sha256(data).hexdigest())
+            for name, data in files]
+    frames = [cache.get(key) for key in keys]
+    missing = [k for k, df in enumerate(frames) if df is None]
+    for k, df in zip(missing, ingest.read_files([files[k] for k in missing], reader, max_workers)):
+        cache.put(keys[k], df)
+        frames[k] = df
+    return ingest.concat_frames(frames)